@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Benchmarks for the credential lookup hot path.
+
+Lookups run against a local HTTP stand-in for the feed and a stub credential
+provider selected through ARTIFACTS_KEYRING_CREDENTIALPROVIDER_PATH, so no
+request leaves the machine. Results are written as JSON, one object per
+scenario, with lookup latencies in milliseconds, the number of credential
+provider processes started and the number of HTTP requests the feed served.
+
+Usage:
+    python benchmarks/bench_lookup.py [--output results.json] [--scenario NAME ...]
+"""
+
+import argparse
+import json
+import os
+import stat
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from artifacts_keyring import ArtifactsKeyringBackend, CredentialProvider  # noqa: E402
+
+STUB_PROVIDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_provider.py")
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            FeedHandler.requests += 1
+        body = b"<html><body></body></html>"
+        self.send_response(401 if self.headers.get("Authorization") is None else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def write_provider_executable(directory):
+    # ARTIFACTS_KEYRING_CREDENTIALPROVIDER_PATH takes a single executable,
+    # so the stub script is wrapped in one for the current interpreter.
+    if sys.platform.startswith("win"):
+        path = os.path.join(directory, "CredentialProvider.Microsoft.cmd")
+        with open(path, "w") as f:
+            f.write('@"{python}" "{script}" %*\n'.format(python=sys.executable, script=STUB_PROVIDER))
+    else:
+        path = os.path.join(directory, "CredentialProvider.Microsoft")
+        with open(path, "w") as f:
+            f.write('#!/bin/sh\nexec "{python}" "{script}" "$@"\n'.format(python=sys.executable, script=STUB_PROVIDER))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+class Bench(object):
+    def __init__(self, feed, log):
+        self.feed = feed
+        self.log = log
+
+    def provider_invocations(self):
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as f:
+            return len(f.readlines())
+
+    def reset(self):
+        # Start every scenario without any state left from the previous one
+        if os.path.exists(self.log):
+            os.remove(self.log)
+        FeedHandler.requests = 0
+        CredentialProvider._ACCESS_CACHE = None
+
+    def measure(self, name, lookups, run):
+        self.reset()
+        start = time.perf_counter()
+        latencies = run()
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        return {
+            "scenario": name,
+            "lookups": lookups,
+            "total_s": round(elapsed, 4),
+            "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+            "median_ms": round(statistics.median(latencies) * 1000, 3),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3),
+            "provider_invocations": self.provider_invocations(),
+            "http_requests": FeedHandler.requests,
+        }
+
+
+def timed(call, *args):
+    start = time.perf_counter()
+    result = call(*args)
+    elapsed = time.perf_counter() - start
+    if result is None:
+        raise RuntimeError("lookup returned no credentials")
+    return elapsed
+
+
+def cold_cache(bench, count=10):
+    def run():
+        latencies = []
+        for _ in range(count):
+            CredentialProvider._ACCESS_CACHE = None
+            latencies.append(timed(ArtifactsKeyringBackend().get_credential, bench.feed, None))
+        return latencies
+    return bench.measure("cold_cache", count, run)
+
+
+def warm_cache(bench, count=1000):
+    def run():
+        backend = ArtifactsKeyringBackend()
+        backend.get_credential(bench.feed, None)
+        return [timed(backend.get_credential, bench.feed, None) for _ in range(count)]
+    return bench.measure("warm_cache", count, run)
+
+
+def warm_get_password(bench, count=1000):
+    def run():
+        backend = ArtifactsKeyringBackend()
+        backend.get_credential(bench.feed, None)
+        return [timed(backend.get_password, bench.feed, "user") for _ in range(count)]
+    return bench.measure("warm_get_password", count, run)
+
+
+def package_urls(bench, count=300):
+    def run():
+        backend = ArtifactsKeyringBackend()
+        return [
+            timed(backend.get_credential, bench.feed + "package{}/".format(i), None)
+            for i in range(count)
+        ]
+    return bench.measure("package_urls_per_feed", count, run)
+
+
+def concurrent_threads(bench, threads=16, count=800, name="concurrent_threads"):
+    def run():
+        backend = ArtifactsKeyringBackend()
+        urls = [bench.feed + "package{}/".format(i) for i in range(count)]
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return list(executor.map(lambda url: timed(backend.get_credential, url, None), urls))
+    return bench.measure(name, count, run)
+
+
+def slow_provider(bench, threads=8, count=64):
+    os.environ["STUB_PROVIDER_DELAY"] = "0.5"
+    try:
+        return concurrent_threads(bench, threads, count, name="slow_provider")
+    finally:
+        del os.environ["STUB_PROVIDER_DELAY"]
+
+
+SCENARIOS = {
+    "cold_cache": cold_cache,
+    "warm_cache": warm_cache,
+    "warm_get_password": warm_get_password,
+    "package_urls_per_feed": package_urls,
+    "concurrent_threads": concurrent_threads,
+    "slow_provider": slow_provider,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run; may be repeated (default: all)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    netloc = "127.0.0.1:{port}".format(port=server.server_address[1])
+    os.environ["ARTIFACTS_KEYRING_EXTRA_HOSTS"] = "127.0.0.1"
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["ARTIFACTS_KEYRING_CREDENTIALPROVIDER_PATH"] = write_provider_executable(directory)
+        os.environ["STUB_PROVIDER_LOG"] = os.path.join(directory, "invocations.log")
+
+        bench = Bench("http://{netloc}/org/_packaging/feed/pypi/simple/".format(netloc=netloc),
+                      os.environ["STUB_PROVIDER_LOG"])
+        results = {
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "scenarios": [SCENARIOS[name](bench) for name in (args.scenario or SCENARIOS)],
+        }
+
+    server.shutdown()
+    server.server_close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
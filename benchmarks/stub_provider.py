@@ -0,0 +1,29 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Credential provider stand-in used by the benchmarks.
+
+Appends one line per invocation to STUB_PROVIDER_LOG and waits
+STUB_PROVIDER_DELAY seconds before printing its credentials.
+"""
+
+import json
+import os
+import sys
+import time
+
+
+def main():
+    log = os.environ.get("STUB_PROVIDER_LOG")
+    if log:
+        with open(log, "a") as f:
+            f.write("invoked\n")
+
+    time.sleep(float(os.environ.get("STUB_PROVIDER_DELAY", "0")))
+    json.dump({"Username": "user", "Password": "pass"}, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
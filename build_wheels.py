@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Builds the platform wheels for several runtime identifiers (RIDs) at once.
+
+Each RID is staged in its own copy of the project under --staging-dir, so that
+builds do not share src/artifacts_keyring/bin. The credential provider archive
+of each RID is fetched through the archive cache of setup.py (see
+ARTIFACTS_CREDENTIAL_PROVIDER_CACHE_DIR), extracted and built into a wheel in a
+separate process. With --offline, only cached archives are used, and
+--sha256 RID=DIGEST checks the archive of a RID against its digest. A timing
+report is printed, or written as JSON with --report.
+
+Usage:
+    python build_wheels.py [--jobs N] [--dist-dir dist] [--offline] [--sha256 RID=DIGEST...]
+                           [--report timings.json] RID...
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Files of the project needed to build a wheel, besides src/
+PROJECT_FILES = ("setup.py", "setup.cfg", "pyproject.toml", "README.md", "LICENSE.txt", "MANIFEST.in")
+
+# Lines of the build log quoted in the report when a build fails
+LOG_TAIL_LINES = 20
+
+# Platform tags of the wheels built for each RID
+PLATFORM_TAGS = {
+    "win-x64": "win_amd64",
+    "win-x86": "win32",
+    "win-arm64": "win_arm64",
+    "osx-x64": "macosx_10_9_x86_64",
+    "osx-arm64": "macosx_11_0_arm64",
+    "linux-x64": "manylinux_2_17_x86_64",
+    "linux-arm64": "manylinux_2_28_aarch64",
+}
+
+
+def load_setup():
+    spec = importlib.util.spec_from_file_location("artifacts_keyring_setup", os.path.join(ROOT, "setup.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def stage_project(staging):
+    # A fresh copy of the project without any previously extracted plugins
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+
+    for name in PROJECT_FILES:
+        shutil.copy2(os.path.join(ROOT, name), staging)
+    shutil.copytree(
+        os.path.join(ROOT, "src"),
+        os.path.join(staging, "src"),
+        ignore=shutil.ignore_patterns("bin", "__pycache__", "*.egg-info"),
+    )
+
+
+def build_wheel(rid, staging_dir, dist_dir, offline, expected_sha256=None):
+    """Stages, extracts and builds the wheel of one RID, returning its timings.
+    """
+    setup_module = load_setup()
+    timings = {"rid": rid}
+    start = time.perf_counter()
+
+    def lap(name, since):
+        now = time.perf_counter()
+        timings[name + "_s"] = round(now - since, 3)
+        return now
+
+    staging = os.path.join(staging_dir, rid)
+    stage_project(staging)
+    step = lap("stage", start)
+
+    download_url = setup_module.get_os_runtime_url(rid)
+    if offline:
+        archive_path = setup_module.get_cached_archive(setup_module.get_archive_cache_dir(), download_url, expected_sha256)
+        if archive_path is None:
+            raise RuntimeError(f"{download_url} is not cached and --offline was given")
+    else:
+        archive_path = setup_module.fetch_archive(download_url, expected_sha256)
+    step = lap("fetch", step)
+
+    dest = os.path.join(staging, "src", "artifacts_keyring", "bin")
+    os.makedirs(dest)
+    setup_module.extract_archive(archive_path, download_url, dest)
+    setup_module.prepare_plugins(dest)
+    setup_module.write_manifest(dest, download_url, os.path.basename(archive_path))
+    step = lap("extract", step)
+
+    # setup.py finds the plugins already extracted and leaves them alone
+    env = dict(os.environ)
+    env[setup_module.CREDENTIAL_PROVIDER_RID_VAR_NAME] = rid
+    env.pop(setup_module.CREDENTIAL_PROVIDER_SHA256_VAR_NAME, None)
+    if expected_sha256:
+        env[setup_module.CREDENTIAL_PROVIDER_SHA256_VAR_NAME] = expected_sha256
+    before = set(os.listdir(dist_dir))
+    log_path = os.path.join(staging, "build.log")
+    with open(log_path, "wb") as log:
+        returncode = subprocess.run(
+            [sys.executable, "setup.py", "-q",
+             "bdist_wheel", "--plat-name", PLATFORM_TAGS[rid], "--dist-dir", dist_dir,
+             "--bdist-dir", os.path.join(staging, "build", "bdist")],
+            cwd=staging, env=env, stdout=log, stderr=subprocess.STDOUT,
+        ).returncode
+    if returncode != 0:
+        with open(log_path, encoding="utf-8", errors="replace") as log:
+            tail = "".join(log.readlines()[-LOG_TAIL_LINES:])
+        raise RuntimeError(f"bdist_wheel exited with status {returncode}, see {log_path}:\n{tail}")
+    lap("build", step)
+
+    wheels = sorted(name for name in set(os.listdir(dist_dir)) - before if PLATFORM_TAGS[rid] in name)
+    timings["wheel"] = wheels[0] if wheels else None
+    timings["log"] = log_path
+    timings["total_s"] = round(time.perf_counter() - start, 3)
+    return timings
+
+
+def build_wheels(rids, staging_dir, dist_dir, jobs=None, offline=False, sha256=None):
+    """Builds the wheels of ``rids`` in parallel and returns their timings
+    in the same order. Failed builds are reported with their error.
+
+    ``sha256`` maps RIDs to the expected digest of their archive. The
+    digest of ARTIFACTS_CREDENTIAL_PROVIDER_SHA256 is only accepted for a
+    single RID, since every RID has its own archive.
+    """
+    rids = list(dict.fromkeys(rids))
+    sha256 = dict(sha256 or {})
+    var_name = load_setup().CREDENTIAL_PROVIDER_SHA256_VAR_NAME
+    if os.environ.get(var_name):
+        if len(rids) > 1:
+            raise ValueError(f"{var_name} applies to a single archive; pass --sha256 RID=DIGEST for each RID instead")
+        sha256.setdefault(rids[0], os.environ[var_name])
+    os.makedirs(dist_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=jobs or min(len(rids), os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(build_wheel, rid, staging_dir, dist_dir, offline, sha256.get(rid)) for rid in rids]
+
+    report = []
+    for rid, future in zip(rids, futures):
+        try:
+            report.append(future.result())
+        except Exception as exc:
+            report.append({"rid": rid, "error": str(exc)})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("rids", nargs="+", metavar="RID", choices=sorted(PLATFORM_TAGS),
+                        help="runtime identifier to build a wheel for")
+    parser.add_argument("--jobs", type=int, help="number of wheels to build at once (default: one per CPU)")
+    parser.add_argument("--dist-dir", default=os.path.join(ROOT, "dist"), help="directory to write the wheels to")
+    parser.add_argument("--staging-dir", default=os.path.join(ROOT, "build", "wheels"),
+                        help="directory in which every RID is staged separately")
+    parser.add_argument("--offline", action="store_true", help="only use cached credential provider archives")
+    parser.add_argument("--sha256", action="append", default=[], metavar="RID=DIGEST",
+                        help="expected SHA-256 digest of the credential provider archive of RID")
+    parser.add_argument("--report", help="file to write the JSON timing report to")
+    args = parser.parse_args()
+
+    sha256 = {}
+    for value in args.sha256:
+        rid, _, digest = value.partition("=")
+        if rid not in PLATFORM_TAGS or not digest:
+            parser.error(f"--sha256 expects RID=DIGEST, got {value!r}")
+        sha256[rid] = digest
+
+    start = time.perf_counter()
+    try:
+        report = build_wheels(args.rids, os.path.abspath(args.staging_dir), os.path.abspath(args.dist_dir),
+                              jobs=args.jobs, offline=args.offline, sha256=sha256)
+    except ValueError as exc:
+        parser.error(str(exc))
+    elapsed = time.perf_counter() - start
+
+    for timings in report:
+        if "error" in timings:
+            print(f"{timings['rid']:<12} FAILED: {timings['error']}")
+        else:
+            print(f"{timings['rid']:<12} fetch {timings['fetch_s']:7.2f}s  extract {timings['extract_s']:7.2f}s  "
+                  f"build {timings['build_s']:7.2f}s  total {timings['total_s']:7.2f}s  {timings['wheel']}")
+    print(f"Built {sum('error' not in timings for timings in report)} of {len(report)} wheels in {elapsed:.2f}s")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"total_s": round(elapsed, 3), "rids": report}, f, indent=2)
+
+    return 1 if any("error" in timings for timings in report) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,8 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-import io
+import hashlib
+import json
 import os
 import platform
 import re
@@ -14,6 +15,7 @@ import zipfile
 import tarfile
 import urllib.request
 import shutil
+import tempfile
 from setuptools import Distribution, setup
 from setuptools.command.build_py import build_py
 from setuptools.command.bdist_wheel import bdist_wheel
@@ -23,6 +25,9 @@ CREDENTIAL_PROVIDER_NET8 = CREDENTIAL_PROVIDER_BASE + "Microsoft.Net8.NuGet.Cred
 CREDENTIAL_PROVIDER_NET8_ZIP = CREDENTIAL_PROVIDER_BASE + "Microsoft.Net8.NuGet.CredentialProvider.zip"
 CREDENTIAL_PROVIDER_NON_SC_VAR_NAME = "ARTIFACTS_CREDENTIAL_PROVIDER_NON_SC"
 CREDENTIAL_PROVIDER_RID_VAR_NAME = "ARTIFACTS_CREDENTIAL_PROVIDER_RID"
+CREDENTIAL_PROVIDER_CACHE_DIR_VAR_NAME = "ARTIFACTS_CREDENTIAL_PROVIDER_CACHE_DIR"
+CREDENTIAL_PROVIDER_SHA256_VAR_NAME = "ARTIFACTS_CREDENTIAL_PROVIDER_SHA256"
+CREDENTIAL_PROVIDER_MANIFEST = ".credential-provider.json"
 
 def get_version(root):
     src = os.path.join(root, "src", "artifacts_keyring", "__init__.py")
@@ -94,21 +99,128 @@ def get_download_url():
         return get_os_runtime_url(runtime_id)
 
 
-def download_credential_provider(dest):
-    if not os.path.isdir(dest):
-        os.makedirs(dest)
+def get_archive_cache_dir():
+    # Downloaded archives are kept across builds, named by their SHA-256 digest
+    custom_dir = os.environ.get(CREDENTIAL_PROVIDER_CACHE_DIR_VAR_NAME, "")
+    if custom_dir:
+        return custom_dir
+
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.join(os.path.expanduser("~"), "Library", "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base, "artifacts-keyring", "credprovider")
+
+def get_file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_cached_archive(cache_dir, download_url, expected_sha256=None):
+    # Archives are stored as archives/<sha256>, and urls/<sha256 of the URL>
+    # records which archive a URL last downloaded to. An expected digest must
+    # match that record, so that a URL is never served another URL's archive.
+    index_path = os.path.join(cache_dir, "urls", hashlib.sha256(download_url.encode("utf-8")).hexdigest())
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path, "r", encoding="utf-8") as f:
+        recorded_sha256 = f.read().strip().lower()
+    if expected_sha256 and expected_sha256.lower() != recorded_sha256:
+        return None
+    expected_sha256 = recorded_sha256
+
+    archive_path = os.path.join(cache_dir, "archives", expected_sha256)
+    if not os.path.isfile(archive_path):
+        return None
+
+    # Do not trust a cached archive that was modified or corrupted
+    if get_file_sha256(archive_path) != expected_sha256.lower():
+        print("Ignoring corrupt cached archive", archive_path)
+        os.remove(archive_path)
+        return None
+
+    return archive_path
+
+def fetch_archive(download_url, expected_sha256=None):
+    cache_dir = get_archive_cache_dir()
+    archive_path = get_cached_archive(cache_dir, download_url, expected_sha256)
+    if archive_path is not None:
+        print("Using cached artifacts-credprovider archive", archive_path)
+        return archive_path
 
-    print("Downloading and extracting artifacts-credprovider to", dest)
-    download_url = get_download_url()
     print("Downloading artifacts-credprovider from", download_url)
+    for name in ("archives", "urls"):
+        os.makedirs(os.path.join(cache_dir, name), exist_ok=True)
+
+    # Stream to a temporary file in the cache, hashing along the way
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=os.path.join(cache_dir, "archives"), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, urllib.request.urlopen(download_url) as download_file:
+            for chunk in iter(lambda: download_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+                f.write(chunk)
+
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            raise RuntimeError(f"SHA-256 of {download_url} is {sha256}, expected {expected_sha256}")
+
+        archive_path = os.path.join(cache_dir, "archives", sha256)
+        os.replace(temp_path, archive_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    index_path = os.path.join(cache_dir, "urls", hashlib.sha256(download_url.encode("utf-8")).hexdigest())
+    with open(index_path, "w", encoding="utf-8") as f:
+        f.write(sha256)
+
+    return archive_path
+
+def read_manifest(dest):
+    try:
+        with open(os.path.join(dest, CREDENTIAL_PROVIDER_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(dest, download_url, sha256):
+    # Records the archive the plugins were extracted from, and the size of
+    # every file, so that an unchanged tree can be reused by the next build
+    files = {}
+    plugins_dir = os.path.join(dest, "plugins")
+    for dirpath, _, filenames in os.walk(plugins_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files[os.path.relpath(path, dest).replace(os.sep, "/")] = os.path.getsize(path)
+
+    with open(os.path.join(dest, CREDENTIAL_PROVIDER_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({"url": download_url, "sha256": sha256, "files": files}, f, indent=2, sort_keys=True)
+
+def is_extracted(dest, download_url, sha256):
+    manifest = read_manifest(dest)
+    if manifest is None or manifest.get("url") != download_url or manifest.get("sha256") != sha256:
+        return False
 
-    with urllib.request.urlopen(download_url) as download_file:
-        if download_url.endswith(".zip"):
-            with zipfile.ZipFile(io.BytesIO(download_file.read())) as zip_file:
-                zip_file.extractall(dest)
-        else:
-            tar = tarfile.open(mode="r|gz", fileobj=download_file)
+    for name, size in manifest.get("files", {}).items():
+        path = os.path.join(dest, *name.split("/"))
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return False
+    return True
 
+def extract_archive(archive_path, download_url, dest):
+    # The archive format follows the URL, since cached archives are named by digest
+    if download_url.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as zip_file:
+            zip_file.extractall(dest)
+    else:
+        with tarfile.open(archive_path, mode="r:gz") as tar:
             # Python 3.12 adds a safety filter for tar extraction
             # to prevent placement of files outside the target directory.
             # https://docs.python.org/3.12/library/tarfile.html#tarfile.tar_filter
@@ -117,6 +229,49 @@ def download_credential_provider(dest):
             else:
                 tar.extractall(dest)
 
+def prepare_plugins(dest):
+    # Removes files of the credential provider that break or are not needed at runtime
+    plugin_dir = os.path.join(dest, "plugins", "netcore", "CredentialProvider.Microsoft")
+
+    # Fix for liblttng-ust.so.0 not being found on Debian 12 and later.
+    # See https://github.com/dotnet/runtime/issues/57784 for more info.
+    clr_trace_path = os.path.join(plugin_dir, "libcoreclrtraceptprovider.so")
+    if os.path.exists(clr_trace_path):
+        print("Removing libcoreclrtraceptprovider.so from plugins directory")
+        os.remove(clr_trace_path)
+
+    # Set executable permissions on the credential provider binary at build time.
+    # This ensures the binary is already executable when packaged into the wheel,
+    # avoiding the need for os.chmod at runtime (which fails for restricted users).
+    # See https://github.com/microsoft/artifacts-keyring/issues/99
+    cred_provider_exe = os.path.join(plugin_dir, "CredentialProvider.Microsoft")
+    if os.path.exists(cred_provider_exe):
+        print("Setting executable permissions on", cred_provider_exe)
+        os.chmod(cred_provider_exe, 0o755)
+
+def download_credential_provider(dest, download_url=None):
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+
+    download_url = download_url or get_download_url()
+    archive_path = fetch_archive(download_url, os.environ.get(CREDENTIAL_PROVIDER_SHA256_VAR_NAME))
+    sha256 = os.path.basename(archive_path)
+
+    if is_extracted(dest, download_url, sha256):
+        print("artifacts-credprovider from", download_url, "is already extracted to", dest)
+        return
+
+    # Clean any previous build artifacts
+    plugins_dir = os.path.join(dest, "plugins")
+    if os.path.exists(plugins_dir):
+        print("Removing previous plugins artifacts in ", plugins_dir)
+        shutil.rmtree(plugins_dir)
+
+    print("Extracting artifacts-credprovider to", dest)
+    extract_archive(archive_path, download_url, dest)
+    prepare_plugins(dest)
+    write_manifest(dest, download_url, sha256)
+
 class BuildKeyring(build_py):
     def run(self):
         super().run()
@@ -133,43 +288,9 @@ class KeyringDistribution(Distribution):
 if __name__ == "__main__":
     root = os.path.dirname(os.path.abspath(__file__))
     dest = os.path.join(root, "src", "artifacts_keyring", "bin")
-    plugins_dir = os.path.join(dest, "plugins")
-
-    # Clean any previous build artifacts
-    if os.path.exists(plugins_dir):
-        print("Removing previous plugins artifacts in ", plugins_dir)
-        shutil.rmtree(plugins_dir)
 
     download_credential_provider(dest)
 
-    # Fix for liblttng-ust.so.0 not being found on Debian 12 and later.
-    # See https://github.com/dotnet/runtime/issues/57784 for more info.
-    clr_trace_path = os.path.join(
-        dest,
-        "plugins",
-        "netcore",
-        "CredentialProvider.Microsoft",
-        "libcoreclrtraceptprovider.so",
-    )
-    if os.path.exists(clr_trace_path):
-        print("Removing libcoreclrtraceptprovider.so from plugins directory")
-        os.remove(clr_trace_path)
-
-    # Set executable permissions on the credential provider binary at build time.
-    # This ensures the binary is already executable when packaged into the wheel,
-    # avoiding the need for os.chmod at runtime (which fails for restricted users).
-    # See https://github.com/microsoft/artifacts-keyring/issues/99
-    cred_provider_exe = os.path.join(
-        dest,
-        "plugins",
-        "netcore",
-        "CredentialProvider.Microsoft",
-        "CredentialProvider.Microsoft",
-    )
-    if os.path.exists(cred_provider_exe):
-        print("Setting executable permissions on", cred_provider_exe)
-        os.chmod(cred_provider_exe, 0o755)
-
     setup(
         version=get_version(root),
         cmdclass={
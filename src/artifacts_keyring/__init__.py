@@ -8,13 +8,85 @@ from __future__ import absolute_import
 __author__ = "Microsoft Corporation <python@microsoft.com>"
 __version__ = "2.0.0rc1"
 
-import warnings
-from .support import urlsplit
-from .plugin import CredentialProvider
+import atexit
+import hashlib
+import os
+import threading
+import time
+from .cache import BackoffError, CredentialCache, FailureCache
+from .support import HostMatcher, env_flag, get_feed_scope, get_org_scope
+from .metrics import emit, timed
 
 import keyring.backend
 import keyring.credentials
 
+# keyring imports every registered backend on startup, so this module only
+# imports what is needed to reject unsupported hosts. The credential
+# provider and HTTP machinery (requests, asyncio...) in .plugin, and the
+# on-disk store, are imported once they are actually needed.
+
+
+def __getattr__(name):
+    if name == "CredentialProvider":
+        from .plugin import CredentialProvider
+        return CredentialProvider
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+_WARM_UP_LOCK = threading.Lock()
+_warm_up_thread = None
+
+
+def _start_warm_up(backend_class):
+    # Runs the credential provider once per process in the background
+    global _warm_up_thread
+    with _WARM_UP_LOCK:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_warm_up, args=(backend_class,), name="artifacts-keyring-warm-up")
+            _warm_up_thread.daemon = True
+            _warm_up_thread.start()
+
+
+def _warm_up(backend_class):
+    try:
+        # Resolved here so that the provider is also imported in the background
+        backend_class._PROVIDER.warm_up()
+    except Exception:
+        # Only an optimization; lookups report any problem themselves
+        pass
+
+
+_HANDOFFS_LOCK = threading.Lock()
+_handoffs = {}
+
+
+def _add_handoff(store, scope, password):
+    # Tokens handed over to other processes only need to stay on disk while
+    # this process runs; they are removed when it exits, unless another
+    # process is still waiting for them
+    with _HANDOFFS_LOCK:
+        if not _handoffs:
+            atexit.register(_discard_handoffs)
+        digest = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        _handoffs[store.directory, scope] = (store, digest)
+
+
+def _discard_handoffs():
+    with _HANDOFFS_LOCK:
+        handoffs = list(_handoffs.items())
+        _handoffs.clear()
+
+    for (_, scope), (store, digest) in handoffs:
+        store.discard_handoff(scope, digest)
+
+
+class _LazyProvider(object):
+    # Resolves ArtifactsKeyringBackend._PROVIDER to the provider selected by
+    # ARTIFACTS_KEYRING_PROVIDER (CredentialProvider by default) on access
+    def __get__(self, instance, owner):
+        from .providers import get_provider_class
+        return get_provider_class(os.environ.get(owner._PROVIDER_VAR_NAME))
+
 
 class ArtifactsKeyringBackend(keyring.backend.KeyringBackend):
     SUPPORTED_NETLOC = (
@@ -23,45 +95,401 @@ class ArtifactsKeyringBackend(keyring.backend.KeyringBackend):
         "pkgs.codedev.ms",
         "pkgs.vsts.me"
     )
-    _PROVIDER = CredentialProvider
+    _PROVIDER = _LazyProvider()
+    _PROVIDER_VAR_NAME = "ARTIFACTS_KEYRING_PROVIDER"
+    _PERSISTENT_CACHE_VAR_NAME = "ARTIFACTS_KEYRING_PERSISTENT_CACHE"
+    _EXTRA_HOSTS_VAR_NAME = "ARTIFACTS_KEYRING_EXTRA_HOSTS"
+    _BACKGROUND_REFRESH_VAR_NAME = "ARTIFACTS_KEYRING_BACKGROUND_REFRESH"
+    _REFRESH_LEAD_VAR_NAME = "ARTIFACTS_KEYRING_REFRESH_LEAD"
+    _PROCESS_LOCK_VAR_NAME = "ARTIFACTS_KEYRING_PROCESS_LOCK"
+    _PREFETCH_WORKERS_VAR_NAME = "ARTIFACTS_KEYRING_PREFETCH_WORKERS"
+    _WARM_UP_VAR_NAME = "ARTIFACTS_KEYRING_PROVIDER_WARMUP"
+    _SHARE_ORG_TOKENS_VAR_NAME = "ARTIFACTS_KEYRING_SHARE_ORG_TOKENS"
+    _HANDOFF_TTL = 60.0
+    _DEFAULT_REFRESH_LEAD = 120.0
 
     priority = 9.9
 
 
     def __init__(self):
-        # In-memory cache of user-pass combination, to allow
-        # fast handling of applications that insist on querying
-        # username and password separately. get_password will
-        # pop from this cache to avoid keeping the value
-        # around for longer than necessary.
-        self._cache = {}
+        # In-memory cache of user-pass combinations keyed by feed scope,
+        # so that every package URL under one feed shares a single token
+        # and applications that insist on querying username and password
+        # separately are handled quickly. Entries expire with the token.
+        self._cache = CredentialCache()
+
+        # Optionally, tokens shared by every feed of an organization keyed by
+        # organization, so that the credential provider runs once per
+        # organization rather than once per feed.
+        self._org_cache = CredentialCache() if env_flag(self._SHARE_ORG_TOKENS_VAR_NAME) else None
+
+        # Feeds for which credentials could not be obtained recently; their
+        # lookups fail fast until the backoff elapses.
+        self._failures = FailureCache()
+
+        # Hosts handled by this backend: the built-in Azure DevOps hosts plus
+        # any configured through ARTIFACTS_KEYRING_EXTRA_HOSTS.
+        self._hosts = HostMatcher.from_config(
+            self.SUPPORTED_NETLOC,
+            os.environ.get(self._EXTRA_HOSTS_VAR_NAME, "")
+        )
+
+        # Optional on-disk store shared by every process of the current user.
+        # With only the cross-process lock enabled, it merely hands a freshly
+        # fetched token over to the processes that waited for the lock.
+        self._process_lock = env_flag(self._PROCESS_LOCK_VAR_NAME)
+        persistent = env_flag(self._PERSISTENT_CACHE_VAR_NAME)
+        if persistent or self._process_lock:
+            from .store import TokenStore
+            self._store = TokenStore()
+            self._store_ttl = None if persistent else self._HANDOFF_TTL
+        else:
+            self._store = None
+
+        # In-flight asynchronous lookups, keyed by event loop and feed scope.
+        self._async_lookups = {}
+
+        # Per feed scope locks making synchronous lookups single-flight.
+        self._scope_locks = {}
+        self._scope_locks_lock = threading.Lock()
+
+        # Optional daemon thread renewing cached credentials shortly
+        # before they expire, so that lookups keep hitting the cache.
+        if env_flag(self._BACKGROUND_REFRESH_VAR_NAME):
+            from .refresh import TokenRefresher
+            self._refresher = TokenRefresher(self._refresh)
+            # Known token expiries (or None) of the scheduled feeds, since
+            # only tokens about to expire need replacing
+            self._token_expiry = {}
+            try:
+                self._refresh_lead = float(os.environ.get(self._REFRESH_LEAD_VAR_NAME, self._DEFAULT_REFRESH_LEAD))
+            except ValueError:
+                self._refresh_lead = self._DEFAULT_REFRESH_LEAD
+        else:
+            self._refresher = None
+
+        # Optionally run the credential provider once in the background, so
+        # that the first lookup does not have to load it from disk.
+        if env_flag(self._WARM_UP_VAR_NAME):
+            _start_warm_up(type(self))
 
 
     def get_credential(self, service, username):
-        try:
-            parsed = urlsplit(service)
-        except Exception as exc:
-            warnings.warn(str(exc))
+        if not self._hosts.matches(service):
             return None
 
-        netloc = parsed.netloc.rpartition("@")[-1]
+        scope = get_feed_scope(service)
+
+        # Cache hits skip the timing machinery; they are the common case
+        cached = self._cache.get(scope)
+        if cached is not None:
+            emit("get_credential", scope=scope, outcome="cache_hit")
+            return keyring.credentials.SimpleCredential(*cached)
+
+        with timed("get_credential", scope=scope) as event:
+            return self._get_credential(service, scope, event)
 
-        if netloc is None or not netloc.endswith(self.SUPPORTED_NETLOC):
+
+    def _get_credential(self, service, scope, event):
+        cached = self._get_cached(scope, event)
+        if cached is not None:
+            return cached
+
+        if self._backing_off(scope, event):
             return None
 
+        # Only one thread per feed fetches credentials; the others wait
+        # for it and then share its result from the cache.
+        with self._get_scope_lock(scope):
+            cached = self._get_cached(scope, event)
+            if cached is not None:
+                return cached
+
+            # The thread that held the lock may just have failed
+            if self._backing_off(scope, event):
+                return None
+
+            if not self._process_lock:
+                return self._fetch_feed(service, scope, event)
+
+            # Likewise across processes: wait for any other process fetching
+            # this feed and pick up the token it handed over.
+            with self._store.waiting(scope), self._store.fetch_lock(scope):
+                cached = self._get_cached(scope, event)
+                if cached is not None:
+                    return cached
+
+                return self._fetch_feed(service, scope, event)
+
+
+    def _fetch_feed(self, service, scope, event):
+        # Sharing needs a way to check the token against each feed
+        if self._org_cache is None or not hasattr(self._PROVIDER, "_can_authenticate"):
+            return self._fetch(service, scope, event)
+
+        # Public feeds get no credentials, not even the organization's
         provider = self._PROVIDER()
+        if hasattr(provider, "_is_public_feed") and provider._is_public_feed(service):
+            from .tokens import Credentials
+            return self._remember(service, scope, Credentials(None, None, anonymous=True), event)
+
+        # The first feed of an organization fetches the token for all of
+        # them; the others wait for it instead of running the provider.
+        org = get_org_scope(service)
+        with self._get_scope_lock(("org", org)):
+            shared = self._org_cache.get_entry(org)
+            if shared is None:
+                credential = self._fetch(service, scope, event)
+                entry = self._cache.get_entry(scope)
+                if entry is not None:
+                    self._org_cache.put(org, *entry)
+                return credential
+
+        username, password, expires_at = shared
+        if provider._can_authenticate(service, (username, password)):
+            event["outcome"] = "org_shared"
+            self._keep(service, scope, username, password, expires_at)
+            return keyring.credentials.SimpleCredential(username, password)
+
+        # This feed does not accept the organization's token
+        event["org_rejected"] = True
+        return self._fetch(service, scope, event)
+
+
+    def _fetch(self, service, scope, event):
+        provider = self._PROVIDER()
+
+        try:
+            credentials = provider.get_credentials(service)
+        except Exception as exc:
+            self._failures.put(scope, str(exc))
+            raise
+
+        return self._remember(service, scope, credentials, event)
+
+
+    def _backing_off(self, scope, event):
+        # True for feeds that recently gave no credentials; raises again
+        # for those where the credential provider recently failed
+        failure = self._failures.get(scope)
+        if failure is None:
+            return False
 
-        username, password = provider.get_credentials(service)
+        error, retry_at = failure
+        retry_in = retry_at - time.time()
+        event["outcome"] = "backoff"
+        event["retry_in"] = round(retry_in, 3)
+        if error is None:
+            return True
+
+        raise BackoffError("{error} (not retrying for another {delay:.0f} seconds)".format(
+            error=error, delay=retry_in
+        ))
+
+
+    def _refresh(self, service, scope):
+        with self._get_scope_lock(scope), timed("refresh", scope=scope) as event:
+            provider = self._PROVIDER()
+            # Nobody is watching a background refresh, so never prompt. A
+            # token about to expire is replaced, since the provider's cached
+            # one would expire just as soon; entries that merely reached the
+            # cache TTL are resolved as usual, and validated if need be.
+            provider.non_interactive = True
+            token_expires_at = self._token_expiry.get(scope)
+            provider.force_refresh = token_expires_at is not None and \
+                token_expires_at - time.time() <= self._refresh_lead
+            event["forced"] = provider.force_refresh
+
+            previous = self._cache.get_entry(scope)
+            self._remember(service, scope, provider.get_credentials(service), event)
+
+            # Providers that cannot renew the token would be asked again and
+            # again until it expires; leave that to the next lookup instead
+            current = self._cache.get_entry(scope)
+            if previous is not None and current is not None and current[2] <= previous[2]:
+                event["renewed"] = False
+                self._refresher.cancel(scope)
+
+
+    async def get_credential_async(self, service, username):
+        """Asynchronous counterpart of get_credential.
+
+        Concurrent lookups for the same feed share a single in-flight
+        request, so only one of them invokes the credential provider.
+        """
+        import asyncio
+
+        if not self._hosts.matches(service):
+            return None
+
+        scope = get_feed_scope(service)
+        cached = self._get_cached(scope)
+        if cached is not None:
+            emit("get_credential_async", scope=scope, outcome="cache_hit")
+            return cached
+
+        key = (asyncio.get_running_loop(), scope)
+        lookup = self._async_lookups.get(key)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._get_credential_async(service, scope))
+            self._async_lookups[key] = lookup
+            lookup.add_done_callback(lambda _: self._async_lookups.pop(key, None))
+
+        # Shielded so that a cancelled caller does not cancel the shared lookup
+        return await asyncio.shield(lookup)
+
+
+    async def _get_credential_async(self, service, scope):
+        import asyncio
+
+        with timed("get_credential_async", scope=scope) as event:
+            # The cross-process lock and the organization's token are shared
+            # with synchronous lookups, so take the same path off the loop
+            if self._process_lock or self._org_cache is not None:
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, self._get_credential, service, scope, event
+                )
+
+            if self._backing_off(scope, event):
+                return None
+
+            provider = self._PROVIDER()
+
+            try:
+                if hasattr(provider, "get_credentials_async"):
+                    credentials = await provider.get_credentials_async(service)
+                else:
+                    credentials = await asyncio.get_running_loop().run_in_executor(None, provider.get_credentials, service)
+            except Exception as exc:
+                self._failures.put(scope, str(exc))
+                raise
+
+            return self._remember(service, scope, credentials, event)
+
+
+    def _get_scope_lock(self, scope):
+        with self._scope_locks_lock:
+            lock = self._scope_locks.get(scope)
+            if lock is None:
+                lock = self._scope_locks[scope] = threading.Lock()
+            return lock
+
+
+    def _get_cached(self, scope, event=None):
+        cached = self._cache.get(scope)
+        if cached is not None:
+            if event is not None:
+                event["outcome"] = "cache_hit"
+            return keyring.credentials.SimpleCredential(*cached)
+
+        if self._store is not None:
+            stored = self._store.get(scope)
+            if stored is not None:
+                if event is not None:
+                    event["outcome"] = "store_hit"
+                username, password, expires_at = stored
+                self._cache.put(scope, username, password, expires_at)
+                # Whichever process exits last with no one left waiting
+                # removes a handed-over token
+                if self._store_ttl is not None:
+                    _add_handoff(self._store, scope, password)
+                return keyring.credentials.SimpleCredential(username, password)
+
+        return None
+
+
+    def _remember(self, service, scope, credentials, event):
+        # Public feeds need no credentials, which is no reason to back off
+        if getattr(credentials, "anonymous", False):
+            event["outcome"] = "anonymous"
+            return None
+
+        username, password = credentials
+        event["outcome"] = "fetched" if username and password else "no_credentials"
 
         if username and password:
-            self._cache[service, username] = password
+            self._failures.discard(scope)
+            expires_at = getattr(credentials, "expires_at", None)
+            if expires_at is not None:
+                from .tokens import get_expiry_margin
+                expires_at -= get_expiry_margin()
+            self._keep(service, scope, username, password, expires_at)
             return keyring.credentials.SimpleCredential(username, password)
 
+        self._failures.put(scope)
+        return None
+
+
+    def _keep(self, service, scope, username, password, expires_at):
+        if self._refresher is not None:
+            self._token_expiry[scope] = expires_at
+        expires_at = self._cache.put(scope, username, password, expires_at)
+        if self._refresher is not None:
+            self._schedule_refresh(service, scope, expires_at)
+        if self._store is not None:
+            if self._store_ttl is not None:
+                expires_at = min(expires_at, time.time() + self._store_ttl)
+                _add_handoff(self._store, scope, password)
+            self._store.put(scope, username, password, expires_at)
+
+
+    def _schedule_refresh(self, service, scope, expires_at):
+        # Refresh ahead of expiry, but never sooner than halfway through the
+        # remaining lifetime so that short-lived entries cannot spin.
+        remaining = expires_at - time.time()
+        if remaining > 0:
+            self._refresher.schedule(scope, service, expires_at - min(self._refresh_lead, remaining / 2))
+
+
+    def prefetch(self, services, max_workers=None):
+        """Fetches credentials for every feed among ``services`` in parallel,
+        so that later lookups are served from the cache (and the on-disk
+        store, if enabled).
+
+        URLs of unsupported hosts are skipped and URLs of the same feed are
+        fetched once. Returns a dict mapping each feed scope to its
+        credential, or None if none could be obtained.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        feeds = {}
+        for service in services:
+            if self._hosts.matches(service):
+                feeds.setdefault(get_feed_scope(service), service)
+
+        if not feeds:
+            return {}
+
+        if max_workers is None:
+            try:
+                max_workers = int(os.environ.get(self._PREFETCH_WORKERS_VAR_NAME, "8"))
+            except ValueError:
+                max_workers = 8
+        max_workers = max(1, min(max_workers, len(feeds)))
+
+        with timed("prefetch", feeds=len(feeds)) as event:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = dict(zip(feeds, executor.map(self._prefetch_one, feeds.values())))
+            event["outcome"] = "fetched" if all(results.values()) else "incomplete"
+            return results
+
+
+    def _prefetch_one(self, service):
+        # One feed failing must not stop the others from being fetched
+        try:
+            return self.get_credential(service, None)
+        except Exception as exc:
+            emit("prefetch_feed", scope=get_feed_scope(service), outcome="error", error=str(exc))
+            return None
+
 
     def get_password(self, service, username):
-        password = self._cache.get((service, username), None)
-        if password is not None:
-            return password
+        if not self._hosts.matches(service):
+            return None
+
+        cached = self._cache.get(get_feed_scope(service))
+        if cached is not None and cached[0] == username:
+            return cached[1]
 
         creds = self.get_credential(service, None)
         if creds and username == creds.username:
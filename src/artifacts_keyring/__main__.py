@@ -0,0 +1,58 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Command line interface of artifacts-keyring.
+
+Usage:
+    python -m artifacts_keyring prefetch [--workers N] <url>...
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import sys
+
+from . import ArtifactsKeyringBackend
+
+
+def prefetch(args):
+    backend = ArtifactsKeyringBackend()
+    # With only ARTIFACTS_KEYRING_PROCESS_LOCK, tokens on disk are handoffs
+    # that are removed when this process exits
+    if backend._store is None or backend._store_ttl is not None:
+        print("warning: ARTIFACTS_KEYRING_PERSISTENT_CACHE is not enabled, so fetched credentials "
+              "are only kept by the credential provider's own session cache", file=sys.stderr)
+
+    results = backend.prefetch(args.urls, max_workers=args.workers)
+    if not results:
+        print("error: none of the URLs is an Azure Artifacts feed", file=sys.stderr)
+        return 1
+
+    for scope, credential in sorted(results.items()):
+        print("{}: {}".format(scope, "ok" if credential is not None else "failed"))
+
+    return 0 if all(results.values()) else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m artifacts_keyring")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    parser_prefetch = commands.add_parser(
+        "prefetch",
+        help="fetch credentials for every feed among the given URLs in parallel",
+    )
+    parser_prefetch.add_argument("urls", nargs="+", metavar="url", help="index or package URL of a feed")
+    parser_prefetch.add_argument("--workers", type=int, default=None,
+                                 help="number of feeds to fetch at once (default: ARTIFACTS_KEYRING_PREFETCH_WORKERS or 8)")
+    parser_prefetch.set_defaults(func=prefetch)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""In-memory credential cache for the Azure DevOps Keyring module.
+"""
+
+from __future__ import absolute_import
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Secret(object):
+    # One cached credential. The password is kept as UTF-8 bytes in a
+    # bytearray so that it can be overwritten once it is no longer needed.
+    __slots__ = ("username", "password", "expires_at")
+
+    def __init__(self, username, password, expires_at):
+        self.username = username
+        self.password = bytearray(password.encode("utf-8"))
+        self.expires_at = expires_at
+
+    def wipe(self):
+        # Best effort: copies handed out as str cannot be erased
+        self.password[:] = bytes(len(self.password))
+
+
+class CredentialCache(object):
+    """Caches credentials per feed scope until they expire. Safe to use
+    from several threads at once.
+
+    Entries without a known expiry are kept for ``ttl`` seconds, which
+    defaults to the value of ARTIFACTS_KEYRING_CACHE_TTL. At most
+    ``max_size`` feeds (ARTIFACTS_KEYRING_CACHE_SIZE) are kept, evicting
+    the least recently used one. Passwords are overwritten in memory once
+    they expire or are evicted.
+    """
+    _TTL_VAR_NAME = "ARTIFACTS_KEYRING_CACHE_TTL"
+    _SIZE_VAR_NAME = "ARTIFACTS_KEYRING_CACHE_SIZE"
+    _DEFAULT_TTL = 600.0
+    _DEFAULT_SIZE = 256
+
+    def __init__(self, ttl=None, max_size=None):
+        if ttl is None:
+            try:
+                ttl = float(os.environ.get(self._TTL_VAR_NAME, self._DEFAULT_TTL))
+            except ValueError:
+                ttl = self._DEFAULT_TTL
+        if max_size is None:
+            try:
+                max_size = int(os.environ.get(self._SIZE_VAR_NAME, self._DEFAULT_SIZE))
+            except ValueError:
+                max_size = self._DEFAULT_SIZE
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope):
+        # Same as get_entry; kept separate since this is the hot path
+        with self._lock:
+            secret = self._entries.get(scope)
+            if secret is None:
+                return None
+
+            if secret.expires_at <= time.time():
+                del self._entries[scope]
+                secret.wipe()
+                return None
+
+            self._entries.move_to_end(scope)
+            return secret.username, secret.password.decode("utf-8")
+
+    def get_entry(self, scope):
+        """Returns ``(username, password, expires_at)`` for ``scope``, or None.
+        """
+        with self._lock:
+            secret = self._entries.get(scope)
+            if secret is None:
+                return None
+
+            if secret.expires_at <= time.time():
+                del self._entries[scope]
+                secret.wipe()
+                return None
+
+            self._entries.move_to_end(scope)
+            return secret.username, secret.password.decode("utf-8"), secret.expires_at
+
+    def put(self, scope, username, password, expires_at=None):
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        secret = _Secret(username, password, expires_at)
+        with self._lock:
+            previous = self._entries.pop(scope, None)
+            self._entries[scope] = secret
+            evicted = [previous] if previous is not None else []
+            while len(self._entries) > self.max_size:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for previous in evicted:
+            previous.wipe()
+        return expires_at
+
+    def discard(self, scope):
+        with self._lock:
+            secret = self._entries.pop(scope, None)
+        if secret is not None:
+            secret.wipe()
+
+    def clear(self):
+        with self._lock:
+            secrets = list(self._entries.values())
+            self._entries.clear()
+        for secret in secrets:
+            secret.wipe()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AccessCache(object):
+    """Remembers per feed scope whether anonymous requests are accepted, so
+    that the anonymous probe is not repeated on every lookup.
+
+    Decisions are kept for ``ttl`` seconds, which defaults to the value of
+    ARTIFACTS_KEYRING_ACCESS_CACHE_TTL, and are also written to ``store``
+    if one is given.
+    """
+    _TTL_VAR_NAME = "ARTIFACTS_KEYRING_ACCESS_CACHE_TTL"
+    _DEFAULT_TTL = 3600.0
+
+    def __init__(self, ttl=None, store=None):
+        if ttl is None:
+            try:
+                ttl = float(os.environ.get(self._TTL_VAR_NAME, self._DEFAULT_TTL))
+            except ValueError:
+                ttl = self._DEFAULT_TTL
+        self.ttl = ttl
+        self.store = store
+        self._entries = {}
+
+    def get(self, scope):
+        entry = self._entries.get(scope)
+        if entry is not None:
+            anonymous, expires_at = entry
+            if expires_at > time.time():
+                return anonymous
+            self._entries.pop(scope, None)
+
+        if self.store is not None:
+            return self.store.get_access(scope)
+
+        return None
+
+    def put(self, scope, anonymous):
+        expires_at = time.time() + self.ttl
+        self._entries[scope] = (anonymous, expires_at)
+        if self.store is not None:
+            self.store.put_access(scope, anonymous, expires_at)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class BackoffError(RuntimeError):
+    """Raised instead of invoking the credential provider for a feed for
+    which it recently failed.
+    """
+    # Reported as the outcome of the lookup by metrics.timed
+    outcome = "backoff"
+
+
+class FailureCache(object):
+    """Remembers per feed scope that credentials could not be obtained, so
+    that lookups fail fast instead of retrying the credential provider.
+
+    After the first failure a feed is backed off for ``backoff`` seconds,
+    doubling with every further failure up to ``max_backoff``; they default
+    to ARTIFACTS_KEYRING_FAILURE_BACKOFF and
+    ARTIFACTS_KEYRING_FAILURE_BACKOFF_MAX. A backoff of 0 disables this.
+    """
+    _BACKOFF_VAR_NAME = "ARTIFACTS_KEYRING_FAILURE_BACKOFF"
+    _MAX_BACKOFF_VAR_NAME = "ARTIFACTS_KEYRING_FAILURE_BACKOFF_MAX"
+    _DEFAULT_BACKOFF = 5.0
+    _DEFAULT_MAX_BACKOFF = 120.0
+
+    def __init__(self, backoff=None, max_backoff=None):
+        if backoff is None:
+            try:
+                backoff = float(os.environ.get(self._BACKOFF_VAR_NAME, self._DEFAULT_BACKOFF))
+            except ValueError:
+                backoff = self._DEFAULT_BACKOFF
+        if max_backoff is None:
+            try:
+                max_backoff = float(os.environ.get(self._MAX_BACKOFF_VAR_NAME, self._DEFAULT_MAX_BACKOFF))
+            except ValueError:
+                max_backoff = self._DEFAULT_MAX_BACKOFF
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, scope):
+        """Returns ``(error, retry_at)`` while ``scope`` is backed off, where
+        ``error`` is the message of the last failure or None if the provider
+        returned no credentials, and None otherwise.
+        """
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is None:
+                return None
+
+            error, failures, retry_at = entry
+            if retry_at <= time.time():
+                return None
+
+            return error, retry_at
+
+    def put(self, scope, error=None):
+        """Records a failure for ``scope`` and returns when to retry it.
+        """
+        if self.backoff <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(scope)
+            failures = entry[1] + 1 if entry is not None else 1
+            retry_at = time.time() + min(self.backoff * 2 ** min(failures - 1, 32), self.max_backoff)
+            self._entries[scope] = (error, failures, retry_at)
+        return retry_at
+
+    def discard(self, scope):
+        with self._lock:
+            self._entries.pop(scope, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
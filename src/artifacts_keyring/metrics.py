@@ -0,0 +1,84 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Timing instrumentation for the credential lookup pipeline.
+
+Each stage of a lookup emits an event: a dict with the ``stage`` name, its
+``duration_ms`` and stage specific fields such as ``outcome``,
+``status_code`` or ``exit_code``. Events are logged at DEBUG level on the
+``artifacts_keyring`` logger, passed to every hook registered with
+add_hook, and appended as JSON lines to the file named by
+ARTIFACTS_KEYRING_METRICS_FILE if it is set.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_METRICS_FILE_VAR_NAME = "ARTIFACTS_KEYRING_METRICS_FILE"
+
+logger = logging.getLogger("artifacts_keyring")
+
+_hooks = []
+_file_lock = threading.Lock()
+
+
+def add_hook(hook):
+    """Registers ``hook`` to be called with every event.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def emit(stage, **fields):
+    metrics_file = os.environ.get(_METRICS_FILE_VAR_NAME)
+    if not _hooks and not metrics_file and not logger.isEnabledFor(logging.DEBUG):
+        return
+
+    event = dict(fields, stage=stage, timestamp=time.time())
+
+    logger.debug("%s: %s", stage, fields)
+
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception:
+            logger.exception("metrics hook %r failed", hook)
+
+    if metrics_file:
+        import json
+
+        try:
+            with _file_lock:
+                with open(metrics_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, default=str) + "\n")
+        except OSError:
+            pass
+
+
+@contextmanager
+def timed(stage, **fields):
+    """Emits an event for ``stage`` once the block exits, including its
+    duration. The block may add fields to the yielded dict; if it raises,
+    the outcome is recorded as "error", or as the ``outcome`` attribute of
+    the exception if it has one.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as exc:
+        fields["outcome"] = getattr(exc, "outcome", "error")
+        fields["error"] = type(exc).__name__
+        raise
+    finally:
+        fields["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        emit(stage, **fields)
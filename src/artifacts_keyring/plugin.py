@@ -5,20 +5,99 @@
 
 from __future__ import absolute_import
 
+import asyncio
 import json
 import os
 import requests
 import subprocess
 import sys
+import threading
+import time
 
 from . import __version__
-from .support import Popen
+from .cache import AccessCache
+from .metrics import timed
+from .protocol import PluginTimeout, get_session
+from .providers import Provider
+from .store import TokenStore
+from .support import Popen, env_flag, get_feed_scope
+from .tokens import Credentials, get_expiry_margin, get_payload_expiry, get_token_expiry
 
 
-class CredentialProvider(object):
+_HTTP_SESSION = None
+_HTTP_SESSION_LOCK = threading.Lock()
+
+# Responses up to this size are read to the end so that their
+# connection can go back to the pool; larger ones are closed instead.
+_MAX_DRAINED_BODY = 64 * 1024
+
+# Limits on what is kept of the credential provider's output: its JSON
+# answer on stdout, and the end of stderr for error messages.
+_MAX_PROVIDER_OUTPUT = 1024 * 1024
+_MAX_STDERR_TAIL = 8 * 1024
+
+
+def _get_http_session():
+    global _HTTP_SESSION
+    with _HTTP_SESSION_LOCK:
+        if _HTTP_SESSION is None:
+            try:
+                pool_size = int(os.environ.get(CredentialProvider._HTTP_POOL_SIZE_VAR_NAME, "10"))
+            except ValueError:
+                pool_size = 10
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _HTTP_SESSION = session
+        return _HTTP_SESSION
+
+
+def _get_http_timeout():
+    try:
+        return float(os.environ.get(CredentialProvider._HTTP_TIMEOUT_VAR_NAME, "30"))
+    except ValueError:
+        return 30.0
+
+
+def _discard_response(response):
+    length = response.headers.get("Content-Length", "")
+    if length.isdigit() and int(length) <= _MAX_DRAINED_BODY:
+        response.content
+    response.close()
+
+
+class _OutputBuffer(object):
+    # Collects at most `limit` bytes, remembering whether more were written
+    # (keeping the last ones if `tail` is set)
+    def __init__(self, limit, tail=False):
+        self.limit = limit
+        self.tail = tail
+        self.data = bytearray()
+        self.truncated = False
+
+    def write(self, chunk):
+        self.data += chunk
+        if len(self.data) > self.limit:
+            self.truncated = True
+            if self.tail:
+                del self.data[:-self.limit]
+            else:
+                del self.data[self.limit:]
+
+    def text(self):
+        return self.data.decode("utf-8", "ignore")
+
+
+class CredentialProvider(Provider):
     _NON_INTERACTIVE_VAR_NAME = "ARTIFACTS_KEYRING_NONINTERACTIVE_MODE"
     _CREDENTIALPROVIDER_PATH_VAR_NAME = "ARTIFACTS_KEYRING_CREDENTIALPROVIDER_PATH"
     _VERBOSITY_VAR_NAME = "ARTIFACTS_KEYRING_VERBOSITY"
+    _PLUGIN_MODE_VAR_NAME = "ARTIFACTS_KEYRING_PLUGIN_MODE"
+    _PLUGIN_IDLE_TIMEOUT_VAR_NAME = "ARTIFACTS_KEYRING_PLUGIN_IDLE_TIMEOUT"
+    _HTTP_POOL_SIZE_VAR_NAME = "ARTIFACTS_KEYRING_HTTP_POOL_SIZE"
+    _HTTP_TIMEOUT_VAR_NAME = "ARTIFACTS_KEYRING_HTTP_TIMEOUT"
+    _PROVIDER_TIMEOUT_VAR_NAME = "ARTIFACTS_KEYRING_PROVIDER_TIMEOUT"
     _PLUGINS_ROOT = os.path.join(
         os.path.dirname(os.path.abspath(__file__)),
         "bin",
@@ -27,57 +106,124 @@ class CredentialProvider(object):
         "CredentialProvider.Microsoft"
     )
 
+    # Shared by all instances; created on first use
+    _ACCESS_CACHE = None
+
+    # The resolved invocation of the credential provider, as a tuple of the
+    # ARTIFACTS_KEYRING_CREDENTIALPROVIDER_PATH it was resolved for and the
+    # command, so that the file system is only searched once per process
+    _RESOLVED = None
+
     def __init__(self):
         # All platforms: prefer ARTIFACTS_KEYRING_CREDENTIALPROVIDER_PATH if set
         custom_path = os.environ.get(self._CREDENTIALPROVIDER_PATH_VAR_NAME, "")
 
+        resolved = CredentialProvider._RESOLVED
+        if resolved is None or resolved[0] != custom_path:
+            resolved = CredentialProvider._RESOLVED = (custom_path, self._resolve(custom_path))
+        self.exe = list(resolved[1])
+
+
+    @classmethod
+    def _resolve(cls, custom_path):
         if custom_path:
             tool_path = custom_path
         elif sys.platform.startswith("win"):
-            tool_path = os.path.join(self._PLUGINS_ROOT, "CredentialProvider.Microsoft.exe")
+            tool_path = os.path.join(cls._PLUGINS_ROOT, "CredentialProvider.Microsoft.exe")
         else:
             # non windows platforms do not use the .exe extension, and the binary may or may
             # not be self-contained (i.e. may require a .NET runtime to be installed)
-            if os.path.exists(self._PLUGINS_ROOT):
-                exe_path = os.path.join(self._PLUGINS_ROOT, 'CredentialProvider.Microsoft')
+            if os.path.exists(cls._PLUGINS_ROOT):
+                exe_path = os.path.join(cls._PLUGINS_ROOT, 'CredentialProvider.Microsoft')
 
                 # If the directory contains a runtimes folder, the binary is not
                 # self-contained and requires a .NET install to run.
-                if os.path.exists(os.path.join(self._PLUGINS_ROOT, "runtimes")):
-                    tool_path = os.path.join(self._PLUGINS_ROOT, "CredentialProvider.Microsoft.dll")
+                if os.path.exists(os.path.join(cls._PLUGINS_ROOT, "runtimes")):
+                    tool_path = os.path.join(cls._PLUGINS_ROOT, "CredentialProvider.Microsoft.dll")
                 else:
                     tool_path = exe_path
             else:
-                tool_path = os.path.join(self._PLUGINS_ROOT, "CredentialProvider.Microsoft")
+                tool_path = os.path.join(cls._PLUGINS_ROOT, "CredentialProvider.Microsoft")
+
+        if not os.path.isfile(tool_path):
+            raise RuntimeError("Unable to find credential provider in the expected path: " + tool_path)
 
         # Determine how to invoke the credential provider
         if tool_path.endswith(".dll"):
-            self.exe = ["dotnet", "exec", tool_path]
-        else:
-            self.exe = [tool_path]
+            return ("dotnet", "exec", tool_path)
+        return (tool_path,)
+
+
+    @classmethod
+    def warm_up(cls):
+        """Runs the credential provider once without requesting credentials,
+        so that its files (and the .NET runtime's) are in the OS file cache
+        by the time credentials are needed.
+        """
+        with timed("warm_up") as event:
+            with Popen(
+                cls().exe + ["-Help"],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            ) as proc:
+                try:
+                    proc.wait(60)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+            event["exit_code"] = proc.returncode
 
-        if not os.path.isfile(tool_path):
-            raise RuntimeError("Unable to find credential provider in the expected path: " + tool_path)
 
     def get_credentials(self, url):
         # Public feed short circuit: return nothing if not getting credentials for the upload endpoint
         # (which always requires auth) and the endpoint is public (can authenticate without credentials).
-        if not self._is_upload_endpoint(url) and self._can_authenticate(url, None):
-            return None, None
+        if self._is_public_feed(url):
+            return Credentials(None, None, anonymous=True)
+
+        # IsRetry=true makes the credential provider skip its own cache
+        if self.force_refresh:
+            return self._with_expiry(self._get_credentials_from_credential_provider(url, is_retry=True))
 
         # Getting credentials with IsRetry=false; the credentials may come from the cache
-        username, password = self._get_credentials_from_credential_provider(url, is_retry=False)
+        credentials = self._with_expiry(self._get_credentials_from_credential_provider(url, is_retry=False))
+        username, password = credentials
 
         # Do not attempt to validate if the credentials could not be obtained
         if username is None or password is None:
-            return username, password
+            return credentials
 
-        # Make sure the credentials are still valid (i.e. not expired)
-        if self._can_authenticate(url, (username, password)):
-            return username, password
+        # Make sure the credentials are still valid (i.e. not expired), locally
+        # if their expiry is known and otherwise by authenticating with them
+        if self._is_valid(url, credentials):
+            return credentials
 
         # The cached credentials are expired; get fresh ones with IsRetry=true
-        return self._get_credentials_from_credential_provider(url, is_retry=True)
+        return self._with_expiry(self._get_credentials_from_credential_provider(url, is_retry=True))
+
+
+    def _is_valid(self, url, credentials):
+        with timed("validate") as event:
+            if credentials.expires_at is not None:
+                event["method"] = "local_expiry"
+                valid = credentials.expires_at - get_expiry_margin() > time.time()
+            else:
+                event["method"] = "network"
+                valid = self._can_authenticate(url, tuple(credentials))
+            event["outcome"] = "valid" if valid else "expired"
+            return valid
+
+
+    def _with_expiry(self, credentials):
+        username, password = credentials
+        expires_at = getattr(credentials, "expires_at", None)
+        if expires_at is None:
+            expires_at = get_token_expiry(password)
+        return Credentials(username, password, expires_at)
+
+
+    def _is_public_feed(self, url):
+        return not self._is_upload_endpoint(url) and self._allows_anonymous_access(url)
 
 
     def _is_upload_endpoint(self, url):
@@ -85,63 +231,312 @@ class CredentialProvider(object):
         return url.endswith("pypi/upload")
 
 
+    @classmethod
+    def _get_access_cache(cls):
+        if cls._ACCESS_CACHE is None:
+            cls._ACCESS_CACHE = AccessCache(store=TokenStore() if TokenStore.is_enabled() else None)
+        return cls._ACCESS_CACHE
+
+
+    def _allows_anonymous_access(self, url):
+        access_cache = self._get_access_cache()
+        scope = get_feed_scope(url)
+
+        with timed("anonymous_check", scope=scope, outcome="cache_hit") as event:
+            anonymous = access_cache.get(scope)
+            if anonymous is None:
+                event["outcome"] = "probed"
+                status_code = self._get_status_code(url, None)
+                anonymous = self._is_authorized(status_code)
+
+                # Server errors say nothing about the feed, so they are not remembered
+                if status_code < 500:
+                    access_cache.put(scope, anonymous)
+
+            event["anonymous"] = anonymous
+            return anonymous
+
+
     def _can_authenticate(self, url, auth):
-        response = requests.get(url, auth=auth)
+        # The upload endpoint only accepts POST requests, so whatever a GET
+        # returns says nothing about the credentials; ask the index instead
+        if self._is_upload_endpoint(url):
+            url = self._get_index_url(url)
+        return self._is_authorized(self._get_status_code(url, auth))
+
+
+    def _get_index_url(self, url):
+        url = url[: -1] if url[-1] == "/" else url
+        return url[: -len("upload")] + "simple/"
 
-        return response.status_code < 500 and \
-            response.status_code != 401 and \
-            response.status_code != 403
+
+    def _is_authorized(self, status_code):
+        return status_code < 500 and \
+            status_code != 401 and \
+            status_code != 403
+
+
+    def _get_status_code(self, url, auth):
+        timeout = _get_http_timeout()
+
+        with timed("http_probe", authenticated=auth is not None) as event:
+            # Only the status code is needed, so the body is streamed and
+            # discarded rather than downloading a potentially large index page.
+            response = _get_http_session().get(url, auth=auth, stream=True, timeout=timeout)
+            try:
+                event["status_code"] = response.status_code
+                return response.status_code
+            finally:
+                _discard_response(response)
 
 
     def _get_credentials_from_credential_provider(self, url, is_retry):
-        non_interactive = self._NON_INTERACTIVE_VAR_NAME in os.environ and \
-            os.environ[self._NON_INTERACTIVE_VAR_NAME] and \
-            str(os.environ[self._NON_INTERACTIVE_VAR_NAME]).lower() == "true"
+        non_interactive = self.non_interactive or env_flag(self._NON_INTERACTIVE_VAR_NAME)
         verbosity = os.environ.get(self._VERBOSITY_VAR_NAME, "Information")
 
-        with Popen(
-            self.exe + [
-                "-Uri", url,
-                "-IsRetry", str(is_retry),
-                "-NonInteractive", str(non_interactive),
-                "-CanShowDialog", "True",
-                "-OutputFormat", "Json",
-                "-Verbosity", verbosity
-            ],
-            stdin=subprocess.DEVNULL,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        ) as proc:
-            # Read all standard error first, which may either display
-            # errors from the credential provider or instructions
-            # from it for Device Flow authentication.
+        if env_flag(self._PLUGIN_MODE_VAR_NAME):
+            with timed("credential_provider", is_retry=is_retry, mode="plugin") as event:
+                return self._get_plugin_credentials(url, is_retry, non_interactive, verbosity, event)
+
+        with timed("credential_provider", is_retry=is_retry, mode="process") as event:
+            return self._run_credential_provider(
+                self._get_provider_command(url, is_retry, non_interactive, verbosity), event
+            )
+
+
+    def _run_credential_provider(self, command, event):
+        timeout = self._get_provider_timeout()
+        output = _OutputBuffer(_MAX_PROVIDER_OUTPUT)
+        stderr = _OutputBuffer(_MAX_STDERR_TAIL, tail=True)
+
+        def forward_stderr():
+            # Standard error may either display errors from the credential
+            # provider or instructions from it for Device Flow authentication.
             for stderr_line in iter(proc.stderr.readline, b''):
-                line = stderr_line.decode("utf-8", "ignore")
-                sys.stderr.write(line)
+                stderr.write(stderr_line)
+                sys.stderr.write(stderr_line.decode("utf-8", "ignore"))
                 sys.stderr.flush()
 
+        def read_stdout():
+            # read1 hands over whatever is available rather than waiting for
+            # a full chunk, which only comes once the pipe is closed
+            for chunk in iter(lambda: proc.stdout.read1(64 * 1024), b''):
+                output.write(chunk)
+
+        def pump(read, pipe):
+            try:
+                read()
+            except (OSError, ValueError):
+                pass
+            finally:
+                # Closing a pipe blocks while it is being read, so each pump
+                # closes its own once the last process holding it open exits
+                pipe.close()
+
+        proc = Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        # Both pipes are read at once so that neither can fill up and block the provider
+        pumps = [
+            threading.Thread(target=pump, args=(forward_stderr, proc.stderr)),
+            threading.Thread(target=pump, args=(read_stdout, proc.stdout)),
+        ]
+        for pump_thread in pumps:
+            pump_thread.daemon = True
+            pump_thread.start()
+
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
             proc.wait()
+            event["timed_out"] = True
+            raise self._get_timeout_error(proc.pid, timeout)
+        finally:
+            # Processes started by the provider may hold the pipes open long
+            # after it exited; its own output is read by then, so the pumps
+            # are given a moment to finish and then left to close the pipes
+            deadline = time.monotonic() + 1
+            for pump_thread in pumps:
+                pump_thread.join(max(0, deadline - time.monotonic()))
+
+        event["exit_code"] = proc.returncode
+
+        if proc.returncode != 0:
+            raise self._get_exit_error(proc.pid, proc.returncode, stderr.text())
+
+        return self._parse_output(output)
+
+
+    def _get_plugin_credentials(self, url, is_retry, non_interactive, verbosity, event):
+        timeout = self._get_provider_timeout()
+        try:
+            return self._get_plugin_session().get_credentials(url, is_retry, non_interactive, verbosity, timeout)
+        except PluginTimeout as exc:
+            event["timed_out"] = True
+            raise self._get_timeout_error(exc.pid, timeout, "respond")
+
+
+    def _get_provider_timeout(self):
+        # Generous by default, since the provider may be waiting for the
+        # user to complete Device Flow authentication; 0 disables it
+        try:
+            timeout = float(os.environ.get(self._PROVIDER_TIMEOUT_VAR_NAME, "900"))
+        except ValueError:
+            timeout = 900.0
+        return timeout if timeout > 0 else None
+
+
+    def _get_plugin_session(self):
+        # Reuse one long-lived provider process for every lookup
+        try:
+            idle_timeout = float(os.environ.get(self._PLUGIN_IDLE_TIMEOUT_VAR_NAME, "300"))
+        except ValueError:
+            idle_timeout = 300.0
+        return get_session(self.exe, idle_timeout=idle_timeout)
+
+
+    def _get_provider_command(self, url, is_retry, non_interactive, verbosity):
+        return self.exe + [
+            "-Uri", url,
+            "-IsRetry", str(is_retry),
+            "-NonInteractive", str(non_interactive),
+            "-CanShowDialog", "True",
+            "-OutputFormat", "Json",
+            "-Verbosity", verbosity
+        ]
+
+
+    def _get_exit_error(self, pid, returncode, stderr):
+        error_msg = "Failed to get credentials: process with PID {pid} exited with code {code}".format(
+            pid=pid, code=returncode
+        )
+        if stderr.strip():
+            error_msg += "; additional error message: {error}".format(error=stderr)
+        else:
+            error_msg += "; no additional error message available, see Credential Provider logs above for details."
+        return RuntimeError(error_msg)
+
+
+    def _get_timeout_error(self, pid, timeout, action="exit"):
+        return RuntimeError(
+            "Failed to get credentials: process with PID {pid} did not {action} within {timeout} seconds "
+            "and was stopped; set {var} to allow more time.".format(
+                pid=pid, action=action, timeout=timeout, var=self._PROVIDER_TIMEOUT_VAR_NAME
+            )
+        )
+
+
+    def _parse_output(self, output):
+        if output.truncated:
+            raise RuntimeError("Failed to get credentials: the Credential Provider's output exceeded {size} bytes.".format(
+                size=output.limit
+            ))
+
+        try:
+            # stdout is expected to be UTF-8 encoded JSON, so decoding errors are not ignored here.
+            payload = output.data.decode("utf-8")
+        except ValueError:
+            raise RuntimeError("Failed to get credentials: the Credential Provider's output could not be decoded using UTF-8.")
 
-            if proc.returncode != 0:
-                stderr = proc.stderr.read().decode("utf-8", "ignore")
+        try:
+            parsed = json.loads(payload)
+            return Credentials(parsed["Username"], parsed["Password"], get_payload_expiry(parsed))
+        except ValueError:
+            raise RuntimeError("Failed to get credentials: the Credential Provider's output could not be parsed as JSON.")
 
-                error_msg = "Failed to get credentials: process with PID {pid} exited with code {code}".format(
-                    pid=proc.pid, code=proc.returncode
+
+    async def get_credentials_async(self, url):
+        # Same flow as get_credentials, with the provider run as an asyncio
+        # subprocess and the blocking HTTP probes run in the default executor.
+        loop = asyncio.get_running_loop()
+
+        if await loop.run_in_executor(None, self._is_public_feed, url):
+            return Credentials(None, None, anonymous=True)
+
+        if self.force_refresh:
+            return self._with_expiry(await self._get_credentials_from_credential_provider_async(url, is_retry=True))
+
+        credentials = self._with_expiry(await self._get_credentials_from_credential_provider_async(url, is_retry=False))
+        username, password = credentials
+
+        if username is None or password is None:
+            return credentials
+
+        if await loop.run_in_executor(None, self._is_valid, url, credentials):
+            return credentials
+
+        return self._with_expiry(await self._get_credentials_from_credential_provider_async(url, is_retry=True))
+
+
+    async def _get_credentials_from_credential_provider_async(self, url, is_retry):
+        non_interactive = self.non_interactive or env_flag(self._NON_INTERACTIVE_VAR_NAME)
+        verbosity = os.environ.get(self._VERBOSITY_VAR_NAME, "Information")
+
+        if env_flag(self._PLUGIN_MODE_VAR_NAME):
+            with timed("credential_provider", is_retry=is_retry, mode="plugin") as event:
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, self._get_plugin_credentials, url, is_retry, non_interactive, verbosity, event
                 )
-                if stderr.strip():
-                    error_msg += "; additional error message: {error}".format(error=stderr)
-                else:
-                    error_msg += "; no additional error message available, see Credential Provider logs above for details."
-                raise RuntimeError(error_msg)
 
-            try:
-                # stdout is expected to be UTF-8 encoded JSON, so decoding errors are not ignored here.
-                payload = proc.stdout.read().decode("utf-8")
-            except ValueError:
-                raise RuntimeError("Failed to get credentials: the Credential Provider's output could not be decoded using UTF-8.")
+        with timed("credential_provider", is_retry=is_retry, mode="process") as event:
+            return await self._run_credential_provider_async(
+                self._get_provider_command(url, is_retry, non_interactive, verbosity), event
+            )
+
+
+    async def _run_credential_provider_async(self, command, event):
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        output = _OutputBuffer(_MAX_PROVIDER_OUTPUT)
+        stderr = _OutputBuffer(_MAX_STDERR_TAIL, tail=True)
+
+        async def forward_stderr():
+            async for stderr_line in proc.stderr:
+                stderr.write(stderr_line)
+                sys.stderr.write(stderr_line.decode("utf-8", "ignore"))
+                sys.stderr.flush()
 
+        async def read_stdout():
+            while True:
+                chunk = await proc.stdout.read(64 * 1024)
+                if not chunk:
+                    break
+                output.write(chunk)
+
+        async def wait_for_exit():
+            # Process.wait() also waits for the pipes to be closed, which
+            # processes started by the provider may hold open after it exited
+            while proc.returncode is None:
+                await asyncio.sleep(0.01)
+
+        # Both pipes are read at once so that neither can fill up and block the provider
+        pumps = asyncio.gather(forward_stderr(), read_stdout())
+
+        timeout = self._get_provider_timeout()
+        try:
+            await asyncio.wait_for(wait_for_exit(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await wait_for_exit()
+            event["timed_out"] = True
+            raise self._get_timeout_error(proc.pid, timeout)
+        finally:
+            # As in _run_credential_provider, the provider's own output is
+            # read by now; the pipes are not waited for any longer
             try:
-                parsed = json.loads(payload)
-                return parsed["Username"], parsed["Password"]
-            except ValueError:
-                raise RuntimeError("Failed to get credentials: the Credential Provider's output could not be parsed as JSON.")
+                await asyncio.wait_for(pumps, 1)
+            except asyncio.TimeoutError:
+                # Closing the transport closes the pipes without waiting
+                # for the processes holding them, and kills nothing
+                proc._transport.close()
+        event["exit_code"] = proc.returncode
+
+        if proc.returncode != 0:
+            raise self._get_exit_error(proc.pid, proc.returncode, stderr.text())
+
+        return self._parse_output(output)
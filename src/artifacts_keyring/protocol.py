@@ -0,0 +1,345 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Long-lived credential provider sessions using the NuGet cross-platform
+plugin protocol.
+
+The credential provider is started once with ``-Plugin`` and kept running;
+requests are exchanged as newline delimited JSON messages over its standard
+input and output. Responses are matched to requests by their RequestId, so
+several lookups can be in flight on one process at the same time.
+"""
+
+from __future__ import absolute_import
+
+import atexit
+import json
+import subprocess
+import sys
+import threading
+import uuid
+
+_PROTOCOL_VERSION = "2.0.0"
+_MINIMUM_PROTOCOL_VERSION = "1.0.0"
+_CLIENT_VERSION = "5.0.0"
+
+
+class PluginProcessExited(RuntimeError):
+    pass
+
+
+class PluginTimeout(RuntimeError):
+    def __init__(self, message, pid):
+        super(PluginTimeout, self).__init__(message)
+        self.pid = pid
+
+
+class _PendingRequest(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.message = None
+        self.error = None
+
+
+class _Channel(object):
+    # A running plugin process and the requests waiting on its responses
+    def __init__(self, proc):
+        self.proc = proc
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending = {}
+        self.error = None
+
+    def is_alive(self):
+        return self.error is None and self.proc.poll() is None
+
+
+class PluginSession(object):
+    """A credential provider process speaking the NuGet plugin protocol.
+
+    The process is started on first use, shut down after ``idle_timeout``
+    seconds without requests and restarted if it exits unexpectedly.
+    """
+
+    def __init__(self, exe, idle_timeout=300.0, handshake_timeout=30.0):
+        self.exe = list(exe)
+        self.idle_timeout = idle_timeout
+        self.handshake_timeout = handshake_timeout
+
+        self._lock = threading.Lock()
+        self._channel = None
+        self._in_flight = 0
+        self._idle_timer = None
+
+    def get_credentials(self, url, is_retry, non_interactive, verbosity, timeout=None):
+        """Returns ``(username, password)`` for ``url``. A plugin that does
+        not answer within ``timeout`` seconds is stopped, so that the next
+        request starts a new one, and PluginTimeout is raised.
+        """
+        payload = {
+            "Uri": url,
+            "IsRetry": bool(is_retry),
+            "IsNonInteractive": bool(non_interactive),
+            "CanShowDialog": True,
+        }
+
+        # A process that crashed is restarted once before giving up
+        for attempt in range(2):
+            channel = self._acquire(verbosity)
+            try:
+                response = self._request(channel, "GetAuthenticationCredentials", payload, timeout=timeout)
+                break
+            except PluginProcessExited:
+                if attempt:
+                    raise
+            except PluginTimeout:
+                self._discard(channel)
+                raise
+            finally:
+                self._release()
+
+        code = response.get("ResponseCode")
+        if code == "NotFound":
+            return None, None
+        if code != "Success":
+            raise RuntimeError(
+                "Failed to get credentials: the Credential Provider plugin responded with {code}; {msg}".format(
+                    code=code, msg=response.get("Message") or "no additional error message available."
+                )
+            )
+        return response.get("Username"), response.get("Password")
+
+    def close(self):
+        with self._lock:
+            self._cancel_idle_timer()
+            channel, self._channel = self._channel, None
+        if channel is not None:
+            self._stop(channel)
+
+    def _acquire(self, verbosity):
+        with self._lock:
+            self._cancel_idle_timer()
+            self._in_flight += 1
+            try:
+                if self._channel is None or not self._channel.is_alive():
+                    self._channel = self._start(verbosity)
+            except BaseException:
+                self._in_flight -= 1
+                raise
+            return self._channel
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            if self._in_flight == 0 and self._channel is not None and self.idle_timeout is not None:
+                self._idle_timer = threading.Timer(self.idle_timeout, self._on_idle)
+                self._idle_timer.daemon = True
+                self._idle_timer.start()
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _discard(self, channel):
+        # A hung plugin cannot be asked to close; requests still waiting on
+        # it fail with PluginProcessExited and are retried on a new process
+        with self._lock:
+            if self._channel is channel:
+                self._channel = None
+        try:
+            channel.proc.kill()
+        except OSError:
+            pass
+
+    def _on_idle(self):
+        with self._lock:
+            if self._in_flight or self._channel is None:
+                return
+            channel, self._channel = self._channel, None
+            self._idle_timer = None
+        self._stop(channel)
+
+    def _start(self, verbosity):
+        channel = _Channel(subprocess.Popen(
+            self.exe + ["-Plugin"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        ))
+
+        reader = threading.Thread(target=self._read_messages, args=(channel,))
+        reader.daemon = True
+        reader.start()
+
+        try:
+            response = self._request(channel, "Handshake", {
+                "ProtocolVersion": _PROTOCOL_VERSION,
+                "MinimumProtocolVersion": _MINIMUM_PROTOCOL_VERSION,
+            }, timeout=self.handshake_timeout)
+            if response.get("ResponseCode") != "Success":
+                raise RuntimeError("Credential Provider plugin handshake failed: " + json.dumps(response))
+
+            self._request(channel, "Initialize", {
+                "ClientVersion": _CLIENT_VERSION,
+                "Culture": "en-US",
+                "RequestTimeout": "00:05:00",
+            }, timeout=self.handshake_timeout)
+            self._request(channel, "SetLogLevel", {"LogLevel": verbosity}, timeout=self.handshake_timeout)
+        except BaseException:
+            self._stop(channel)
+            raise
+
+        return channel
+
+    def _stop(self, channel):
+        proc = channel.proc
+        try:
+            self._send(channel, {
+                "RequestId": str(uuid.uuid4()),
+                "Type": "Request",
+                "Method": "Close",
+                "Payload": None,
+            })
+            proc.stdin.close()
+        except (OSError, ValueError):
+            pass
+
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def _send(self, channel, message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with channel.write_lock:
+            channel.proc.stdin.write(data)
+            channel.proc.stdin.flush()
+
+    def _request(self, channel, method, payload, timeout=None):
+        request_id = str(uuid.uuid4())
+        pending = _PendingRequest()
+
+        with channel.lock:
+            if channel.error is not None:
+                raise channel.error
+            channel.pending[request_id] = pending
+
+        try:
+            try:
+                self._send(channel, {
+                    "RequestId": request_id,
+                    "Type": "Request",
+                    "Method": method,
+                    "Payload": payload,
+                })
+            except (OSError, ValueError):
+                raise PluginProcessExited("Credential Provider plugin exited before accepting a request.")
+
+            if not pending.event.wait(timeout):
+                raise PluginTimeout(
+                    "Credential Provider plugin with PID {pid} did not respond to {method} within {timeout} seconds.".format(
+                        pid=channel.proc.pid, method=method, timeout=timeout
+                    ),
+                    channel.proc.pid
+                )
+        finally:
+            with channel.lock:
+                channel.pending.pop(request_id, None)
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.message.get("Payload") or {}
+
+    def _read_messages(self, channel):
+        proc = channel.proc
+        for line in iter(proc.stdout.readline, b""):
+            try:
+                message = json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue
+
+            message_type = message.get("Type")
+            if message_type == "Request":
+                self._handle_plugin_request(channel, message)
+                continue
+
+            with channel.lock:
+                pending = channel.pending.get(message.get("RequestId"))
+            if pending is None:
+                continue
+
+            if message_type == "Response":
+                pending.message = message
+                pending.event.set()
+            elif message_type == "Fault":
+                pending.error = RuntimeError(
+                    "Credential Provider plugin fault: " + str((message.get("Payload") or {}).get("Message"))
+                )
+                pending.event.set()
+            # Progress messages only signal that the plugin is still working
+
+        proc.wait()
+        error = PluginProcessExited(
+            "Credential Provider plugin with PID {pid} exited with code {code}".format(
+                pid=proc.pid, code=proc.returncode
+            )
+        )
+        with channel.lock:
+            channel.error = error
+            waiting = list(channel.pending.values())
+        for pending in waiting:
+            if not pending.event.is_set():
+                pending.error = error
+                pending.event.set()
+
+    def _handle_plugin_request(self, channel, message):
+        method = message.get("Method")
+        payload = message.get("Payload") or {}
+
+        message_type = "Response"
+        if method == "Handshake":
+            response = {"ResponseCode": "Success", "ProtocolVersion": _PROTOCOL_VERSION}
+        elif method == "Log":
+            sys.stderr.write(str(payload.get("Message", "")) + "\n")
+            sys.stderr.flush()
+            response = {"ResponseCode": "Success"}
+        else:
+            message_type = "Fault"
+            response = {"Message": "Unsupported method: " + str(method)}
+
+        try:
+            self._send(channel, {
+                "RequestId": message.get("RequestId"),
+                "Type": message_type,
+                "Method": method,
+                "Payload": response,
+            })
+        except (OSError, ValueError):
+            pass
+
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(exe, idle_timeout=300.0):
+    """Returns the shared plugin session for the credential provider ``exe``.
+    """
+    key = tuple(exe)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _SESSIONS[key] = PluginSession(exe, idle_timeout=idle_timeout)
+        return session
+
+
+@atexit.register
+def close_sessions():
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS.values())
+        _SESSIONS.clear()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,232 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Credential providers used by ArtifactsKeyringBackend.
+
+Besides the Azure Artifacts Credential Provider (CredentialProvider in
+.plugin), credentials can be obtained in-process from tokens in the
+environment or through the OAuth client credentials flow, which is all
+non-interactive environments such as CI need. ARTIFACTS_KEYRING_PROVIDER
+selects the providers to use, in order, separated by commas: the names in
+PROVIDERS or the import path (``module:Class``) of a custom Provider.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+import json
+import os
+import threading
+import time
+
+from .support import get_feed_scope
+
+PROVIDERS = {
+    "credprovider": "artifacts_keyring.plugin:CredentialProvider",
+    "env": "artifacts_keyring.providers:EnvTokenProvider",
+    "client_credentials": "artifacts_keyring.providers:ClientCredentialsProvider",
+}
+DEFAULT_PROVIDER = "credprovider"
+
+_provider_classes = {}
+
+
+class Provider(object):
+    """Interface of the objects behind ArtifactsKeyringBackend._PROVIDER.
+
+    A provider is created without arguments for every lookup that is not
+    served from a cache. get_credentials returns a ``(username, password)``
+    pair for the URL of a feed, or ``(None, None)`` if it has none; a
+    tokens.Credentials lets it report when the password expires, or that
+    the feed needs no credentials. Providers may also implement
+    ``async get_credentials_async(url)``.
+    """
+
+    # Set to True to never prompt, e.g. for background refreshes; the
+    # credential provider also honors ARTIFACTS_KEYRING_NONINTERACTIVE_MODE
+    non_interactive = False
+
+    # Set to True to get a new token rather than one the provider cached,
+    # e.g. to renew credentials before they expire
+    force_refresh = False
+
+    def get_credentials(self, url):
+        raise NotImplementedError()
+
+    @classmethod
+    def warm_up(cls):
+        """Prepares the provider ahead of the first lookup, if that helps.
+        """
+        pass
+
+
+class ChainProvider(Provider):
+    """Asks each of ``providers`` in turn and returns the first credentials
+    found.
+    """
+    providers = ()
+
+    def get_credentials(self, url):
+        for provider_class in self.providers:
+            provider = provider_class()
+            provider.non_interactive = self.non_interactive
+            provider.force_refresh = self.force_refresh
+
+            credentials = provider.get_credentials(url)
+            username, password = credentials
+            if username and password or getattr(credentials, "anonymous", False):
+                return credentials
+
+        return None, None
+
+    @classmethod
+    def warm_up(cls):
+        for provider_class in cls.providers:
+            provider_class.warm_up()
+
+
+class EnvTokenProvider(Provider):
+    """Returns tokens handed over in the environment, as with the Azure
+    Artifacts Credential Provider: the entry of
+    VSS_NUGET_EXTERNAL_FEED_ENDPOINTS matching the feed, or else
+    VSS_NUGET_ACCESSTOKEN for every feed.
+    """
+    _ENDPOINTS_VAR_NAME = "VSS_NUGET_EXTERNAL_FEED_ENDPOINTS"
+    _ACCESS_TOKEN_VAR_NAME = "VSS_NUGET_ACCESSTOKEN"
+    _ACCESS_TOKEN_USERNAME = "VssSessionToken"
+
+    def get_credentials(self, url):
+        from .tokens import Credentials, get_token_expiry
+
+        endpoints = os.environ.get(self._ENDPOINTS_VAR_NAME)
+        if endpoints:
+            try:
+                entries = json.loads(endpoints)["endpointCredentials"]
+            except (ValueError, KeyError, TypeError):
+                raise RuntimeError("Failed to get credentials: {} is not valid JSON with endpointCredentials.".format(
+                    self._ENDPOINTS_VAR_NAME
+                ))
+
+            scope = get_feed_scope(url)
+            for entry in entries:
+                endpoint = entry.get("endpoint", "")
+                if endpoint and (get_feed_scope(endpoint) == scope or url.lower().startswith(endpoint.lower())):
+                    password = entry.get("password")
+                    return Credentials(entry.get("username") or self._ACCESS_TOKEN_USERNAME, password,
+                                       get_token_expiry(password))
+
+        token = os.environ.get(self._ACCESS_TOKEN_VAR_NAME)
+        if token:
+            return Credentials(self._ACCESS_TOKEN_USERNAME, token, get_token_expiry(token))
+
+        return None, None
+
+
+class ClientCredentialsProvider(Provider):
+    """Requests a Microsoft Entra ID token for Azure DevOps with the OAuth
+    client credentials flow, configured like azure-identity: AZURE_TENANT_ID
+    and AZURE_CLIENT_ID, with either AZURE_CLIENT_SECRET or a federated
+    token in the file named by AZURE_FEDERATED_TOKEN_FILE.
+
+    One token serves every feed, so it is shared by all instances until
+    it expires.
+    """
+    _TENANT_ID_VAR_NAME = "AZURE_TENANT_ID"
+    _CLIENT_ID_VAR_NAME = "AZURE_CLIENT_ID"
+    _CLIENT_SECRET_VAR_NAME = "AZURE_CLIENT_SECRET"
+    _FEDERATED_TOKEN_FILE_VAR_NAME = "AZURE_FEDERATED_TOKEN_FILE"
+    _AUTHORITY_HOST_VAR_NAME = "AZURE_AUTHORITY_HOST"
+    _DEFAULT_AUTHORITY_HOST = "https://login.microsoftonline.com"
+    # The Azure DevOps resource
+    _SCOPE = "499b84ac-1321-427f-aa17-267ca6975798/.default"
+    _USERNAME = "AzureDevOps"
+
+    # Tokens keyed by token endpoint and client ID, with their expiry
+    _TOKENS = {}
+    _TOKENS_LOCK = threading.Lock()
+
+    def get_credentials(self, url):
+        from .tokens import Credentials, get_expiry_margin
+
+        tenant_id = os.environ.get(self._TENANT_ID_VAR_NAME)
+        client_id = os.environ.get(self._CLIENT_ID_VAR_NAME)
+        if not tenant_id or not client_id:
+            return None, None
+
+        authority = os.environ.get(self._AUTHORITY_HOST_VAR_NAME) or self._DEFAULT_AUTHORITY_HOST
+        token_url = "{authority}/{tenant}/oauth2/v2.0/token".format(authority=authority.rstrip("/"), tenant=tenant_id)
+
+        key = (token_url, client_id)
+        with self._TOKENS_LOCK:
+            cached = self._TOKENS.get(key)
+            if cached is None or self.force_refresh or cached[1] - get_expiry_margin() <= time.time():
+                cached = self._TOKENS[key] = self._request_token(token_url, client_id)
+
+        token, expires_at = cached
+        return Credentials(self._USERNAME, token, expires_at)
+
+    def _request_token(self, token_url, client_id):
+        from .metrics import timed
+        from .plugin import _get_http_session, _get_http_timeout
+
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": client_id,
+            "scope": self._SCOPE,
+        }
+        secret = os.environ.get(self._CLIENT_SECRET_VAR_NAME)
+        token_file = os.environ.get(self._FEDERATED_TOKEN_FILE_VAR_NAME)
+        if secret:
+            data["client_secret"] = secret
+        elif token_file:
+            with open(token_file, "r", encoding="utf-8") as f:
+                data["client_assertion"] = f.read().strip()
+            data["client_assertion_type"] = "urn:ietf:params:oauth:client-assertion-type:jwt-bearer"
+        else:
+            raise RuntimeError("Failed to get credentials: set {} or {} to use the client credentials flow.".format(
+                self._CLIENT_SECRET_VAR_NAME, self._FEDERATED_TOKEN_FILE_VAR_NAME
+            ))
+
+        with timed("token_request") as event:
+            response = _get_http_session().post(token_url, data=data, timeout=_get_http_timeout())
+            event["status_code"] = response.status_code
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = {}
+
+        if response.status_code != 200 or "access_token" not in payload:
+            raise RuntimeError("Failed to get credentials: the token request to {url} failed with status {code}: {error}".format(
+                url=token_url, code=response.status_code,
+                error=payload.get("error_description") or payload.get("error") or "no details available"
+            ))
+
+        return payload["access_token"], time.time() + float(payload.get("expires_in", 3600))
+
+
+def get_provider_class(spec=None):
+    """Returns the provider class for ``spec``, a comma separated list of
+    provider names or import paths; several providers are chained.
+    """
+    spec = spec or DEFAULT_PROVIDER
+    provider_class = _provider_classes.get(spec)
+    if provider_class is None:
+        classes = tuple(_import_provider(name.strip()) for name in spec.split(",") if name.strip())
+        if len(classes) == 1:
+            provider_class = classes[0]
+        else:
+            provider_class = type("ChainProvider", (ChainProvider,), {"providers": classes})
+        _provider_classes[spec] = provider_class
+    return provider_class
+
+
+def _import_provider(name):
+    path = PROVIDERS.get(name.lower(), name)
+    module_name, _, attribute = path.partition(":")
+    if not attribute:
+        raise ValueError("Unknown credential provider {!r}; expected one of {} or module:Class".format(
+            name, ", ".join(sorted(PROVIDERS))
+        ))
+    return getattr(importlib.import_module(module_name), attribute)
@@ -0,0 +1,70 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Background renewal of cached credentials shortly before they expire.
+"""
+
+from __future__ import absolute_import
+
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger("artifacts_keyring")
+
+
+class TokenRefresher(object):
+    """Calls ``refresh(service, scope)`` from a daemon thread at the time
+    scheduled for each feed scope. Scheduling a scope again replaces its
+    previous schedule.
+    """
+
+    def __init__(self, refresh):
+        self._refresh = refresh
+        self._condition = threading.Condition()
+        self._queue = []
+        self._scheduled = {}
+        self._thread = None
+
+    def schedule(self, scope, service, refresh_at):
+        with self._condition:
+            self._scheduled[scope] = refresh_at
+            heapq.heappush(self._queue, (refresh_at, scope, service))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="artifacts-keyring-refresh")
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._condition.notify()
+
+    def cancel(self, scope):
+        with self._condition:
+            self._scheduled.pop(scope, None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._queue:
+                        refresh_at, scope, service = self._queue[0]
+                        delay = refresh_at - time.time()
+                        if delay <= 0:
+                            heapq.heappop(self._queue)
+                            # Skip entries that were rescheduled or cancelled
+                            if self._scheduled.get(scope) == refresh_at:
+                                del self._scheduled[scope]
+                                break
+                            continue
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+
+            try:
+                self._refresh(service, scope)
+            except Exception:
+                # The next foreground lookup fetches credentials itself
+                logger.debug("Background refresh of %s failed", scope, exc_info=True)
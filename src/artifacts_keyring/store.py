@@ -0,0 +1,331 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Persistent, per-user token store for the Azure DevOps Keyring module.
+
+Tokens are stored one file per feed scope in a directory only readable
+by the current user, so that separate processes (pip, twine, tox envs...)
+can share a token instead of each launching the credential provider.
+"""
+
+from __future__ import absolute_import
+
+import contextlib
+import errno
+import glob
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from .support import env_flag
+
+if sys.platform.startswith("win"):
+    import msvcrt
+else:
+    import fcntl
+
+
+def get_cache_dir():
+    """Returns the per-user cache directory used by artifacts-keyring.
+    """
+    custom_dir = os.environ.get(TokenStore._DIR_VAR_NAME, "")
+    if custom_dir:
+        return custom_dir
+
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.join(os.path.expanduser("~"), "Library", "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base, "artifacts-keyring")
+
+
+def _is_process_alive(pid):
+    if sys.platform.startswith("win"):
+        # os.kill would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class FileLock(object):
+    """An exclusive advisory lock on ``path``, held while the context is entered.
+    Unless ``blocking`` is set, entering raises OSError if the lock is held.
+    """
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if sys.platform.startswith("win"):
+                while True:
+                    try:
+                        msvcrt.locking(self._fd, msvcrt.LK_LOCK if self.blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError as exc:
+                        # LK_LOCK gives up after ~10 seconds; keep waiting
+                        if exc.errno != errno.EDEADLOCK or not self.blocking:
+                            raise
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BaseException:
+            os.close(self._fd)
+            self._fd = None
+            raise
+        return self
+
+    def __exit__(self, ex_type, ex_value, ex_tb):
+        try:
+            if sys.platform.startswith("win"):
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class TokenStore(object):
+    # Also checked by ArtifactsKeyringBackend, which avoids importing this module
+    _ENABLED_VAR_NAME = "ARTIFACTS_KEYRING_PERSISTENT_CACHE"
+    _DIR_VAR_NAME = "ARTIFACTS_KEYRING_CACHE_DIR"
+
+    def __init__(self, directory=None):
+        self.directory = os.path.join(directory or get_cache_dir(), "tokens")
+
+    @classmethod
+    def is_enabled(cls):
+        return env_flag(cls._ENABLED_VAR_NAME)
+
+    def _path(self, scope):
+        return os.path.join(
+            self.directory,
+            hashlib.sha256(scope.encode("utf-8")).hexdigest()
+        )
+
+    def _ensure_directory(self):
+        # Other processes may be creating the directory at the same time
+        os.makedirs(self.directory, 0o700, exist_ok=True)
+        if not sys.platform.startswith("win"):
+            os.chmod(self.directory, 0o700)
+
+    def lock(self, scope, blocking=True):
+        """Returns a context manager holding the cross-process lock guarding
+        writes to the records of ``scope``.
+        """
+        self._ensure_directory()
+        return FileLock(self._path(scope) + ".lock", blocking)
+
+    @contextlib.contextmanager
+    def fetch_lock(self, scope):
+        """Holds the cross-process lock taken while credentials for ``scope``
+        are fetched, so that only one process at a time launches the
+        credential provider for a feed. If the lock cannot be taken, e.g.
+        because the directory is not writable, the context is entered
+        without it, since the lock is only an optimization.
+        """
+        lock = None
+        try:
+            self._ensure_directory()
+            lock = FileLock(self._path(scope) + ".fetch.lock")
+            lock.__enter__()
+        except OSError:
+            lock = None
+
+        try:
+            yield
+        finally:
+            if lock is not None:
+                lock.__exit__(None, None, None)
+
+    @contextlib.contextmanager
+    def waiting(self, scope):
+        """Marks the calling thread as waiting for credentials for ``scope``
+        from another process while the context is entered, so that they are
+        not discarded before it has read them.
+        """
+        path = "{}.wait.{}.{}".format(self._path(scope), os.getpid(), threading.get_ident())
+        try:
+            self._ensure_directory()
+            open(path, "w").close()
+        except OSError:
+            path = None
+
+        try:
+            yield
+        finally:
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def get(self, scope):
+        """Returns ``(username, password, expires_at)`` for ``scope``, or None
+        if nothing valid is stored.
+        """
+        record = self._read(scope, ".json")
+        try:
+            return record["username"], record["password"], record["expires_at"]
+        except (KeyError, TypeError):
+            return None
+
+    def put(self, scope, username, password, expires_at):
+        """Atomically stores the credentials for ``scope``. Failures to
+        write are ignored, since the store is only an optimization.
+        """
+        self._put(scope, ".json", {
+            "scope": scope,
+            "username": username,
+            "password": password,
+            "expires_at": expires_at,
+        })
+
+    def get_access(self, scope):
+        """Returns whether ``scope`` was found to allow anonymous access, or
+        None if that is not known.
+        """
+        record = self._read(scope, ".access.json")
+        try:
+            return bool(record["anonymous"])
+        except (KeyError, TypeError):
+            return None
+
+    def put_access(self, scope, anonymous, expires_at):
+        self._put(scope, ".access.json", {
+            "scope": scope,
+            "anonymous": anonymous,
+            "expires_at": expires_at,
+        })
+
+    def discard(self, scope):
+        for suffix in (".json", ".access.json"):
+            try:
+                os.remove(self._path(scope) + suffix)
+            except OSError:
+                pass
+
+    def discard_handoff(self, scope, digest):
+        """Removes the credentials stored for ``scope`` if they are still
+        those whose password has the SHA-256 ``digest``, i.e. if no other
+        process has stored newer ones since, and no live process is waiting
+        to read them. Called at exit, so it never waits for another process;
+        records it leaves behind are removed once they expire.
+        """
+        if self._has_waiters(scope):
+            return
+
+        path = self._path(scope) + ".json"
+        try:
+            with self.lock(scope, blocking=False):
+                record = self._load(path)
+                try:
+                    password = record["password"]
+                except (KeyError, TypeError):
+                    return
+                if hashlib.sha256(password.encode("utf-8")).hexdigest() == digest:
+                    os.remove(path)
+        except (OSError, AttributeError):
+            pass
+
+    def _has_waiters(self, scope):
+        # Markers are named <path>.wait.<pid>.<thread>; those of processes
+        # that were killed while waiting are removed rather than honored
+        waiting = False
+        for marker in glob.glob(glob.escape(self._path(scope)) + ".wait.*"):
+            try:
+                pid = int(marker.rsplit(".", 2)[1])
+            except ValueError:
+                continue
+            if pid == os.getpid() or _is_process_alive(pid):
+                waiting = True
+            else:
+                try:
+                    os.remove(marker)
+                except OSError:
+                    pass
+        return waiting
+
+    def _read(self, scope, suffix):
+        path = self._path(scope) + suffix
+        record = self._load(path)
+        try:
+            if record["scope"] != scope:
+                return None
+            if record["expires_at"] <= time.time():
+                self._remove_expired(scope, path)
+                return None
+        except (KeyError, TypeError):
+            return None
+        return record
+
+    def _load(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remove_expired(self, scope, path):
+        # Expired records hold no useful token, but may still hold a secret.
+        # Another process may have replaced the file since it was read.
+        try:
+            with self.lock(scope):
+                record = self._load(path)
+                if record is not None and record.get("expires_at", 0) <= time.time():
+                    os.remove(path)
+        except (OSError, AttributeError, TypeError):
+            pass
+
+    def _put(self, scope, suffix, record):
+        try:
+            with self.lock(scope):
+                self._write(self._path(scope) + suffix, record)
+        except OSError:
+            pass
+
+    def _write(self, path, record):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+        try:
+            # mkstemp creates the file readable and writable by the owner only
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
@@ -6,6 +6,9 @@
 """Helper imports for the Azure DevOps Keyring module.
 """
 
+import os
+import re
+
 # *********************************************************
 # Import the correct urlsplit function
 
@@ -28,3 +31,126 @@ if not hasattr(Popen, "__enter__"):
 
         def __exit__(self, ex_type, ex_value, ex_tb):
             pass
+
+
+# *********************************************************
+# Decide quickly whether a URL's host is handled by this module
+
+# Scheme (optional) and network location of a URL, as urlsplit would find them
+_NETLOC_PATTERN = re.compile(r"(?:[A-Za-z][A-Za-z0-9+.-]*:)?//([^/?#]*)")
+
+
+def get_netloc(url):
+    """Returns the network location of ``url`` with a single precompiled
+    match, since this runs for every keyring query.
+    """
+    match = _NETLOC_PATTERN.match(url)
+    return match.group(1) if match is not None else ""
+
+
+class HostMatcher(object):
+    """Matches the host of URLs against host suffixes and exact host names,
+    remembering the decision for recently seen network locations.
+    """
+    _MEMO_SIZE = 256
+
+    def __init__(self, suffixes=(), exact=()):
+        self.suffixes = tuple(suffix.lower() for suffix in suffixes)
+        self.exact = frozenset(host.lower() for host in exact)
+        self._memo = {}
+
+    @classmethod
+    def from_config(cls, suffixes, extra_hosts):
+        """Creates a matcher for the built-in ``suffixes`` plus the entries of
+        ``extra_hosts``, separated by commas or whitespace. Entries starting
+        with "." or "*." match any host ending with them; other entries only
+        match that exact host.
+        """
+        suffixes = list(suffixes)
+        exact = []
+        for entry in extra_hosts.replace(",", " ").split():
+            if entry.startswith("*."):
+                suffixes.append(entry[1:])
+            elif entry.startswith("."):
+                suffixes.append(entry)
+            else:
+                exact.append(entry)
+        return cls(suffixes, exact)
+
+    def matches(self, url):
+        netloc = get_netloc(url)
+        decision = self._memo.get(netloc)
+        if decision is None:
+            host = netloc.rpartition("@")[-1].lower()
+            if host.startswith("["):
+                host = host.partition("]")[0] + "]"
+            else:
+                host = host.partition(":")[0]
+
+            decision = host in self.exact or (bool(host) and host.endswith(self.suffixes))
+
+            # A full memo is simply dropped; it only holds recent decisions
+            if len(self._memo) >= self._MEMO_SIZE:
+                self._memo.clear()
+            self._memo[netloc] = decision
+        return decision
+
+
+# *********************************************************
+# Normalize a feed URL to the scope its credentials cover
+
+def get_feed_scope(url):
+    """Returns the feed scope (host, organization, project and feed) of an
+    Azure Artifacts URL, so that every package URL under one feed maps to
+    the same key. URLs that do not contain a ``_packaging/<feed>`` segment
+    are returned unchanged.
+    """
+    try:
+        parsed = urlsplit(url)
+    except ValueError:
+        return url
+
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    lowered = [segment.lower() for segment in segments]
+
+    if "_packaging" not in lowered:
+        return url
+
+    index = lowered.index("_packaging")
+    if index + 1 >= len(segments):
+        return url
+
+    netloc = parsed.netloc.rpartition("@")[-1]
+    return "{scheme}://{netloc}/{path}".format(
+        scheme=parsed.scheme,
+        netloc=netloc,
+        path="/".join(segments[:index + 2]),
+    ).lower()
+
+
+def get_org_scope(url):
+    """Returns the Azure DevOps organization of a URL: the host and first
+    path segment on dev.azure.com hosts, otherwise the host, whose tokens
+    are usually accepted by every feed of the organization.
+    """
+    try:
+        parsed = urlsplit(url)
+    except ValueError:
+        return url
+
+    netloc = parsed.netloc.rpartition("@")[-1].lower()
+    if netloc.endswith("dev.azure.com"):
+        segments = [segment for segment in parsed.path.split("/") if segment]
+        if segments:
+            return "{scheme}://{netloc}/{org}".format(scheme=parsed.scheme, netloc=netloc, org=segments[0].lower())
+    return "{scheme}://{netloc}".format(scheme=parsed.scheme, netloc=netloc)
+
+
+# *********************************************************
+# Read boolean switches from the environment
+
+def env_flag(name):
+    """Returns True if the environment variable ``name`` is set to "true"
+    (case insensitive).
+    """
+    return str(os.environ.get(name, "")).lower() == "true"
@@ -0,0 +1,75 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Helpers for reasoning about token lifetimes without a network round-trip.
+"""
+
+from __future__ import absolute_import
+
+import base64
+import binascii
+import json
+import os
+from datetime import datetime
+
+_EXPIRY_MARGIN_VAR_NAME = "ARTIFACTS_KEYRING_EXPIRY_MARGIN"
+_DEFAULT_EXPIRY_MARGIN = 300.0
+
+# Fields of the credential provider's JSON output that may carry the expiry
+_EXPIRY_FIELDS = ("ExpiresOn", "Expiration")
+
+
+class Credentials(tuple):
+    """A ``(username, password)`` pair that also records when the password
+    expires, as a POSIX timestamp, if that is known. ``(None, None)`` pairs
+    are marked ``anonymous`` for feeds that need no credentials at all.
+    """
+
+    def __new__(cls, username, password, expires_at=None, anonymous=False):
+        self = tuple.__new__(cls, (username, password))
+        self.expires_at = expires_at
+        self.anonymous = anonymous
+        return self
+
+
+def get_expiry_margin():
+    """Returns how many seconds before their expiry tokens are treated as expired.
+    """
+    try:
+        return float(os.environ.get(_EXPIRY_MARGIN_VAR_NAME, _DEFAULT_EXPIRY_MARGIN))
+    except ValueError:
+        return _DEFAULT_EXPIRY_MARGIN
+
+
+def get_token_expiry(token):
+    """Returns the ``exp`` claim of ``token`` if it is a JWT, otherwise None.
+    """
+    if not isinstance(token, str) or token.count(".") != 2:
+        return None
+
+    payload = token.split(".")[1]
+    payload += "=" * (-len(payload) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload.encode("ascii")).decode("utf-8"))
+        return float(claims["exp"])
+    except (binascii.Error, ValueError, KeyError, TypeError, UnicodeError):
+        return None
+
+
+def get_payload_expiry(payload):
+    """Returns the expiry reported in the credential provider's parsed JSON
+    output, accepting either a POSIX timestamp or an ISO 8601 date.
+    """
+    for field in _EXPIRY_FIELDS:
+        value = payload.get(field)
+        if value is None:
+            continue
+        if isinstance(value, (int, float)):
+            return float(value)
+        try:
+            return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            continue
+    return None
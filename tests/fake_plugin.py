@@ -0,0 +1,97 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""A stand-in for CredentialProvider.Microsoft that speaks the NuGet plugin
+protocol. The requested Uri controls its behavior:
+
+* ``.../slow`` answers after a short delay, letting later requests overtake it
+* ``.../crash`` exits the process without answering
+* ``.../missing`` answers with ResponseCode NotFound
+* ``.../hang`` never answers
+
+Every process writes its PID to the file named by FAKE_PLUGIN_LOG, so tests
+can count how many processes were started.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+write_lock = threading.Lock()
+
+
+def send(message):
+    with write_lock:
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
+
+
+def respond(request, payload):
+    send({
+        "RequestId": request["RequestId"],
+        "Type": "Response",
+        "Method": request["Method"],
+        "Payload": payload,
+    })
+
+
+def get_credentials(request):
+    uri = request["Payload"]["Uri"]
+    if uri.endswith("/slow"):
+        time.sleep(0.5)
+    elif uri.endswith("/crash"):
+        os._exit(3)
+    elif uri.endswith("/missing"):
+        respond(request, {"ResponseCode": "NotFound"})
+        return
+    elif uri.endswith("/hang"):
+        return
+
+    respond(request, {
+        "ResponseCode": "Success",
+        "Username": "user",
+        "Password": "{pid}:{retry}:{uri}".format(
+            pid=os.getpid(), retry=request["Payload"]["IsRetry"], uri=uri
+        ),
+    })
+
+
+def main():
+    assert sys.argv[1:] == ["-Plugin"]
+
+    log = os.environ.get("FAKE_PLUGIN_LOG")
+    if log:
+        with open(log, "a") as f:
+            f.write(str(os.getpid()) + "\n")
+
+    # Plugins also perform their own handshake with the host
+    send({
+        "RequestId": str(uuid.uuid4()),
+        "Type": "Request",
+        "Method": "Handshake",
+        "Payload": {"ProtocolVersion": "2.0.0", "MinimumProtocolVersion": "1.0.0"},
+    })
+
+    for line in sys.stdin:
+        message = json.loads(line)
+        if message["Type"] != "Request":
+            continue
+
+        method = message["Method"]
+        if method == "Handshake":
+            respond(message, {"ResponseCode": "Success", "ProtocolVersion": "2.0.0"})
+        elif method in ("Initialize", "SetLogLevel"):
+            respond(message, {"ResponseCode": "Success"})
+        elif method == "GetAuthenticationCredentials":
+            threading.Thread(target=get_credentials, args=(message,)).start()
+        elif method == "Close":
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""A stand-in for CredentialProvider.Microsoft accepting the same command line.
+
+Environment variables control its behavior:
+
+* FAKE_PROVIDER_LOG: file to which every invocation appends its -Uri
+* FAKE_PROVIDER_DELAY: seconds to wait before answering
+* FAKE_PROVIDER_EXIT_CODE: exit code to fail with instead of answering
+* FAKE_PROVIDER_EXPIRES_IN: seconds until the returned token expires, reported
+  in the output so that no validation request is needed
+* FAKE_PROVIDER_PADDING: size of a padding field added to the output, which
+  is then written before anything else, while stderr is still open
+* FAKE_PROVIDER_BACKGROUND: seconds a process started in the background,
+  which inherits stdout and stderr, keeps running after the provider exits
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def main():
+    args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+
+    log = os.environ.get("FAKE_PROVIDER_LOG")
+    if log:
+        with open(log, "a") as f:
+            f.write(args["-Uri"] + "\n")
+
+    output = {
+        "Username": "user",
+        "Password": "pass:" + args["-IsRetry"],
+    }
+
+    background = os.environ.get("FAKE_PROVIDER_BACKGROUND")
+    if background:
+        subprocess.Popen([sys.executable, "-c", "import time; time.sleep({})".format(float(background))])
+
+    padding = int(os.environ.get("FAKE_PROVIDER_PADDING", "0"))
+    if padding:
+        output["Padding"] = "x" * padding
+        json.dump(output, sys.stdout)
+        sys.stdout.flush()
+
+    sys.stderr.write("[Information] [CredentialProvider]Fake provider invoked\n")
+    sys.stderr.flush()
+
+    time.sleep(float(os.environ.get("FAKE_PROVIDER_DELAY", "0")))
+
+    exit_code = int(os.environ.get("FAKE_PROVIDER_EXIT_CODE", "0"))
+    if exit_code:
+        sys.exit(exit_code)
+
+    expires_in = os.environ.get("FAKE_PROVIDER_EXPIRES_IN")
+    if expires_in:
+        output["ExpiresOn"] = time.time() + float(expires_in)
+
+    if not padding:
+        json.dump(output, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import importlib
+import os
+import zipfile
+
+import pytest
+
+from .test_setup import FILES, PLUGIN_DIR, ROOT, make_archive, seed_cache, setup_module  # noqa: F401
+
+
+def test_build_wheels_offline(setup_module, tmp_path, monkeypatch):
+    # The builds run in worker processes, which import build_wheels by name
+    monkeypatch.syspath_prepend(ROOT)
+    build_wheels = importlib.import_module("build_wheels")
+    rids = ["linux-x64", "osx-arm64", "win-x64"]
+    # win-x64 is not cached, so only its build fails
+    for rid in rids[:2]:
+        url = setup_module.get_os_runtime_url(rid)
+        seed_cache(setup_module, url, make_archive(url))
+
+    dist_dir = tmp_path / "dist"
+    report = build_wheels.build_wheels(rids, str(tmp_path / "staging"), str(dist_dir), jobs=2, offline=True)
+
+    assert [timings["rid"] for timings in report] == rids
+    assert "is not cached" in report[2]["error"]
+    for rid, timings in zip(rids[:2], report):
+        assert set(timings) >= {"stage_s", "fetch_s", "extract_s", "build_s", "total_s"}
+        assert timings["wheel"].endswith(build_wheels.PLATFORM_TAGS[rid] + ".whl")
+        assert os.path.isfile(timings["log"])
+
+        # Each wheel holds the plugins of its own RID only
+        with zipfile.ZipFile(str(dist_dir / timings["wheel"])) as wheel:
+            names = wheel.namelist()
+        assert "artifacts_keyring/bin/" + PLUGIN_DIR + "CredentialProvider.Microsoft.dll" in names
+        assert not any(name.endswith("libcoreclrtraceptprovider.so") for name in names)
+
+    assert os.path.isdir(tmp_path / "staging" / "linux-x64" / "src" / "artifacts_keyring" / "bin")
+    assert not os.path.exists(os.path.join(ROOT, "build", "wheels"))
+
+
+def test_build_wheels_digest_per_rid(setup_module, tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(ROOT)
+    build_wheels = importlib.import_module("build_wheels")
+    rids = ["linux-x64", "win-x64"]
+    dll = "artifacts_keyring/bin/" + PLUGIN_DIR + "CredentialProvider.Microsoft.dll"
+
+    # Each RID's archive holds a plugin of its own
+    sha256 = {}
+    for rid in rids:
+        url = setup_module.get_os_runtime_url(rid)
+        files = dict(FILES, **{PLUGIN_DIR + "CredentialProvider.Microsoft.dll": rid.encode("utf-8")})
+        sha256[rid] = seed_cache(setup_module, url, make_archive(url, files))
+
+    # One digest cannot stand for the archives of several RIDs
+    monkeypatch.setenv(setup_module.CREDENTIAL_PROVIDER_SHA256_VAR_NAME, sha256["linux-x64"])
+    with pytest.raises(ValueError, match="--sha256 RID=DIGEST"):
+        build_wheels.build_wheels(rids, str(tmp_path / "staging"), str(tmp_path / "dist"), offline=True)
+    monkeypatch.delenv(setup_module.CREDENTIAL_PROVIDER_SHA256_VAR_NAME)
+
+    # Nor is a RID's archive found by another RID's digest
+    report = build_wheels.build_wheels(rids[1:], str(tmp_path / "staging"), str(tmp_path / "dist"), offline=True,
+                                       sha256={"win-x64": sha256["linux-x64"]})
+    assert "is not cached" in report[0]["error"]
+
+    report = build_wheels.build_wheels(rids, str(tmp_path / "staging"), str(tmp_path / "dist"), offline=True,
+                                       sha256=sha256)
+    for rid, timings in zip(rids, report):
+        with zipfile.ZipFile(str(tmp_path / "dist" / timings["wheel"])) as wheel:
+            assert wheel.read(dll) == rid.encode("utf-8")
+
+
+def test_build_wheels_failure_log(setup_module, tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(ROOT)
+    build_wheels = importlib.import_module("build_wheels")
+    url = setup_module.get_os_runtime_url("linux-x64")
+    seed_cache(setup_module, url, make_archive(url))
+
+    # A setup.py that fails, staged in place of the project's
+    stage_project = build_wheels.stage_project
+
+    def stage_broken_project(staging):
+        stage_project(staging)
+        with open(os.path.join(staging, "setup.py"), "w") as f:
+            f.write("import sys\nprint('the build broke')\nsys.exit(3)\n")
+
+    monkeypatch.setattr(build_wheels, "stage_project", stage_broken_project)
+    with pytest.raises(RuntimeError) as excinfo:
+        build_wheels.build_wheel("linux-x64", str(tmp_path / "staging"), str(tmp_path), offline=True)
+
+    log_path = str(tmp_path / "staging" / "linux-x64" / "build.log")
+    assert "status 3, see " + log_path in str(excinfo.value)
+    assert "the build broke" in str(excinfo.value)
+    with open(log_path) as f:
+        assert f.read() == "the build broke\n"
@@ -0,0 +1,136 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import sys
+import threading
+import time
+
+from artifacts_keyring import CredentialProvider
+from artifacts_keyring.protocol import PluginProcessExited, PluginSession, PluginTimeout, close_sessions
+
+import pytest
+
+FAKE_PLUGIN = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_plugin.py")]
+FEED = "https://pkgs.dev.azure.com/org/_packaging/feed/pypi/simple/"
+
+
+@pytest.fixture
+def plugin_log(monkeypatch, tmp_path):
+    log = tmp_path / "pids.txt"
+    monkeypatch.setenv("FAKE_PLUGIN_LOG", str(log))
+    yield lambda: log.read_text().split() if log.exists() else []
+
+
+@pytest.fixture
+def session(plugin_log):
+    session = PluginSession(FAKE_PLUGIN)
+    yield session
+    session.close()
+
+
+def test_session_reuses_process(session, plugin_log):
+    username, password = session.get_credentials(FEED + "a", False, True, "Information")
+    assert username == "user"
+    assert password.endswith(":False:" + FEED + "a")
+
+    username, password = session.get_credentials(FEED + "b", True, True, "Information")
+    assert password.endswith(":True:" + FEED + "b")
+    assert len(plugin_log()) == 1
+
+
+def test_session_multiplexes_requests(session):
+    finished = []
+
+    def lookup(uri):
+        session.get_credentials(uri, False, True, "Information")
+        finished.append(uri)
+
+    slow = threading.Thread(target=lookup, args=(FEED + "slow",))
+    slow.start()
+    time.sleep(0.1)
+    lookup(FEED + "fast")
+    slow.join()
+
+    assert finished == [FEED + "fast", FEED + "slow"]
+
+
+def test_session_not_found(session):
+    assert session.get_credentials(FEED + "missing", False, True, "Information") == (None, None)
+
+
+def test_session_restarts_after_crash(session, plugin_log):
+    session.get_credentials(FEED + "a", False, True, "Information")
+
+    # The crashed process is restarted once, which crashes again
+    with pytest.raises(PluginProcessExited):
+        session.get_credentials(FEED + "crash", False, True, "Information")
+
+    username, password = session.get_credentials(FEED + "a", False, True, "Information")
+    assert password.startswith(plugin_log()[-1] + ":")
+    assert len(plugin_log()) == 3
+
+
+def test_session_timeout_restarts_plugin(session, plugin_log):
+    with pytest.raises(PluginTimeout, match="did not respond to GetAuthenticationCredentials within 0.5 seconds"):
+        session.get_credentials(FEED + "hang", False, True, "Information", timeout=0.5)
+
+    # The hung process is stopped and the next request starts a new one
+    username, password = session.get_credentials(FEED + "a", False, True, "Information", timeout=5)
+    assert password.startswith(plugin_log()[-1] + ":")
+    assert len(plugin_log()) == 2
+
+
+def test_session_idle_shutdown(plugin_log):
+    session = PluginSession(FAKE_PLUGIN, idle_timeout=0.1)
+    session.get_credentials(FEED + "a", False, True, "Information")
+    time.sleep(0.5)
+    assert session._channel is None
+
+    session.get_credentials(FEED + "a", False, True, "Information")
+    assert len(plugin_log()) == 2
+    session.close()
+
+
+def test_provider_plugin_mode(monkeypatch, plugin_log):
+    monkeypatch.setenv(CredentialProvider._PLUGIN_MODE_VAR_NAME, "true")
+    monkeypatch.setenv(CredentialProvider._CREDENTIALPROVIDER_PATH_VAR_NAME, FAKE_PLUGIN[1])
+
+    provider = CredentialProvider()
+    provider.exe = FAKE_PLUGIN
+    try:
+        for package in ("numpy", "six"):
+            username, password = provider._get_credentials_from_credential_provider(FEED + package, False)
+            assert username == "user"
+    finally:
+        close_sessions()
+
+    assert len(plugin_log()) == 1
+
+
+def test_provider_plugin_mode_timeout(monkeypatch, plugin_log):
+    monkeypatch.setenv(CredentialProvider._PLUGIN_MODE_VAR_NAME, "true")
+    monkeypatch.setenv(CredentialProvider._CREDENTIALPROVIDER_PATH_VAR_NAME, FAKE_PLUGIN[1])
+    monkeypatch.setenv(CredentialProvider._PROVIDER_TIMEOUT_VAR_NAME, "0.5")
+
+    provider = CredentialProvider()
+    provider.exe = FAKE_PLUGIN
+    try:
+        with pytest.raises(RuntimeError, match="did not respond within 0.5 seconds"):
+            provider._get_credentials_from_credential_provider(FEED + "hang", False)
+    finally:
+        close_sessions()
+
+
+def test_plugin_idle_timeout_falls_back_to_default(monkeypatch):
+    monkeypatch.setenv(CredentialProvider._PLUGIN_IDLE_TIMEOUT_VAR_NAME, "forever")
+    monkeypatch.setenv(CredentialProvider._CREDENTIALPROVIDER_PATH_VAR_NAME, FAKE_PLUGIN[1])
+
+    provider = CredentialProvider()
+    provider.exe = FAKE_PLUGIN
+    try:
+        assert provider._get_plugin_session().idle_timeout == 300.0
+    finally:
+        close_sessions()
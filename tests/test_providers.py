@@ -0,0 +1,156 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from artifacts_keyring import ArtifactsKeyringBackend, CredentialProvider
+from artifacts_keyring.providers import (
+    ChainProvider, ClientCredentialsProvider, EnvTokenProvider, get_provider_class
+)
+
+import pytest
+
+FEED = "https://pkgs.dev.azure.com/org/_packaging/feed/pypi/simple/"
+
+
+class TokenHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+        self.requests.append((self.path, {key: values[0] for key, values in form.items()}))
+
+        if form.get("client_secret") == ["secret"] or "client_assertion" in form:
+            status, payload = 200, {"token_type": "Bearer", "expires_in": 3600,
+                                    "access_token": "token{}".format(len(self.requests))}
+        else:
+            status, payload = 401, {"error": "invalid_client", "error_description": "AADSTS7000215: Invalid client secret."}
+
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def token_server(monkeypatch):
+    monkeypatch.setattr(TokenHandler, "requests", [])
+    monkeypatch.setattr(ClientCredentialsProvider, "_TOKENS", {})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TokenHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    monkeypatch.setenv(ClientCredentialsProvider._AUTHORITY_HOST_VAR_NAME, "http://127.0.0.1:{}/".format(server.server_address[1]))
+    monkeypatch.setenv(ClientCredentialsProvider._TENANT_ID_VAR_NAME, "tenant")
+    monkeypatch.setenv(ClientCredentialsProvider._CLIENT_ID_VAR_NAME, "client")
+    monkeypatch.setenv(ClientCredentialsProvider._CLIENT_SECRET_VAR_NAME, "secret")
+    yield TokenHandler
+    server.shutdown()
+    server.server_close()
+
+
+def test_env_token_provider(monkeypatch):
+    monkeypatch.delenv(EnvTokenProvider._ENDPOINTS_VAR_NAME, raising=False)
+    monkeypatch.delenv(EnvTokenProvider._ACCESS_TOKEN_VAR_NAME, raising=False)
+    assert EnvTokenProvider().get_credentials(FEED) == (None, None)
+
+    monkeypatch.setenv(EnvTokenProvider._ACCESS_TOKEN_VAR_NAME, "token")
+    assert EnvTokenProvider().get_credentials(FEED) == ("VssSessionToken", "token")
+
+    monkeypatch.setenv(EnvTokenProvider._ENDPOINTS_VAR_NAME, json.dumps({"endpointCredentials": [
+        {"endpoint": "https://pkgs.dev.azure.com/org/_packaging/other/pypi/simple/", "username": "u", "password": "other"},
+        {"endpoint": "https://pkgs.dev.azure.com/org/_packaging/Feed/pypi/simple/", "username": "u", "password": "feed"},
+    ]}))
+    assert EnvTokenProvider().get_credentials(FEED + "numpy/") == ("u", "feed")
+    assert EnvTokenProvider().get_credentials("https://pkgs.dev.azure.com/org/_packaging/third/pypi/simple/") == \
+        ("VssSessionToken", "token")
+
+    monkeypatch.setenv(EnvTokenProvider._ENDPOINTS_VAR_NAME, "not json")
+    with pytest.raises(RuntimeError, match="VSS_NUGET_EXTERNAL_FEED_ENDPOINTS"):
+        EnvTokenProvider().get_credentials(FEED)
+
+
+def test_client_credentials_provider(token_server):
+    username, password = credentials = ClientCredentialsProvider().get_credentials(FEED)
+    assert (username, password) == ("AzureDevOps", "token1")
+    assert credentials.expires_at == pytest.approx(time.time() + 3600, abs=60)
+
+    path, form = token_server.requests[0]
+    assert path == "/tenant/oauth2/v2.0/token"
+    assert form == {
+        "grant_type": "client_credentials",
+        "client_id": "client",
+        "client_secret": "secret",
+        "scope": "499b84ac-1321-427f-aa17-267ca6975798/.default",
+    }
+
+    # The token is shared by every feed until it expires
+    assert ClientCredentialsProvider().get_credentials(FEED.replace("feed", "other"))[1] == "token1"
+    assert len(token_server.requests) == 1
+
+
+def test_client_credentials_provider_bad_timeout(monkeypatch, token_server):
+    monkeypatch.setenv(CredentialProvider._HTTP_TIMEOUT_VAR_NAME, "30s")
+    assert ClientCredentialsProvider().get_credentials(FEED)[1] == "token1"
+
+
+def test_client_credentials_provider_federated_token(monkeypatch, tmp_path, token_server):
+    assertion = tmp_path / "token"
+    assertion.write_text("assertion\n")
+    monkeypatch.delenv(ClientCredentialsProvider._CLIENT_SECRET_VAR_NAME)
+    monkeypatch.setenv(ClientCredentialsProvider._FEDERATED_TOKEN_FILE_VAR_NAME, str(assertion))
+
+    assert ClientCredentialsProvider().get_credentials(FEED)[1] == "token1"
+    form = token_server.requests[0][1]
+    assert form["client_assertion"] == "assertion"
+    assert form["client_assertion_type"] == "urn:ietf:params:oauth:client-assertion-type:jwt-bearer"
+
+
+def test_client_credentials_provider_errors(monkeypatch, token_server):
+    monkeypatch.setenv(ClientCredentialsProvider._CLIENT_SECRET_VAR_NAME, "wrong")
+    with pytest.raises(RuntimeError, match="failed with status 401: AADSTS7000215"):
+        ClientCredentialsProvider().get_credentials(FEED)
+
+    monkeypatch.delenv(ClientCredentialsProvider._TENANT_ID_VAR_NAME)
+    assert ClientCredentialsProvider().get_credentials(FEED) == (None, None)
+
+
+def test_get_provider_class():
+    assert get_provider_class(None) is CredentialProvider
+    assert get_provider_class("env") is EnvTokenProvider
+    assert get_provider_class("artifacts_keyring.providers:EnvTokenProvider") is EnvTokenProvider
+
+    chain = get_provider_class("env, client_credentials")
+    assert issubclass(chain, ChainProvider)
+    assert chain.providers == (EnvTokenProvider, ClientCredentialsProvider)
+    assert get_provider_class("env, client_credentials") is chain
+
+    with pytest.raises(ValueError, match="Unknown credential provider 'nope'"):
+        get_provider_class("nope")
+
+
+def test_backend_uses_selected_provider(monkeypatch, token_server):
+    monkeypatch.setenv(ArtifactsKeyringBackend._PROVIDER_VAR_NAME, "env,client_credentials")
+    monkeypatch.delenv(EnvTokenProvider._ENDPOINTS_VAR_NAME, raising=False)
+    monkeypatch.delenv(EnvTokenProvider._ACCESS_TOKEN_VAR_NAME, raising=False)
+
+    # Without a token in the environment, the client credentials flow is used
+    creds = ArtifactsKeyringBackend().get_credential(FEED, None)
+    assert (creds.username, creds.password) == ("AzureDevOps", "token1")
+
+    monkeypatch.setenv(EnvTokenProvider._ACCESS_TOKEN_VAR_NAME, "token")
+    creds = ArtifactsKeyringBackend().get_credential(FEED, None)
+    assert (creds.username, creds.password) == ("VssSessionToken", "token")
+    assert len(token_server.requests) == 1
@@ -0,0 +1,136 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import hashlib
+import importlib.util
+import io
+import os
+import sys
+import tarfile
+import zipfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_DIR = "plugins/netcore/CredentialProvider.Microsoft/"
+FILES = {
+    PLUGIN_DIR + "CredentialProvider.Microsoft": b"#!/bin/sh\n",
+    PLUGIN_DIR + "CredentialProvider.Microsoft.dll": b"assembly",
+    PLUGIN_DIR + "libcoreclrtraceptprovider.so": b"library",
+}
+ZIP_URL = "https://example.invalid/Microsoft.osx-x64.NuGet.CredentialProvider.zip"
+TAR_URL = "https://example.invalid/Microsoft.linux-x64.NuGet.CredentialProvider.tar.gz"
+
+
+@pytest.fixture
+def setup_module(monkeypatch, tmp_path):
+    spec = importlib.util.spec_from_file_location("artifacts_keyring_setup", os.path.join(ROOT, "setup.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    monkeypatch.setenv(module.CREDENTIAL_PROVIDER_CACHE_DIR_VAR_NAME, str(tmp_path / "cache"))
+    monkeypatch.delenv(module.CREDENTIAL_PROVIDER_SHA256_VAR_NAME, raising=False)
+
+    # Every test runs offline
+    def urlopen(url):
+        raise AssertionError("downloaded " + url)
+
+    monkeypatch.setattr(module.urllib.request, "urlopen", urlopen)
+    yield module
+
+
+def make_archive(url, files=FILES):
+    buffer = io.BytesIO()
+    if url.endswith(".zip"):
+        with zipfile.ZipFile(buffer, "w") as zip_file:
+            for name, data in files.items():
+                zip_file.writestr(name, data)
+    else:
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def seed_cache(module, url, data):
+    cache_dir = module.get_archive_cache_dir()
+    sha256 = hashlib.sha256(data).hexdigest()
+    os.makedirs(os.path.join(cache_dir, "archives"), exist_ok=True)
+    with open(os.path.join(cache_dir, "archives", sha256), "wb") as f:
+        f.write(data)
+    os.makedirs(os.path.join(cache_dir, "urls"), exist_ok=True)
+    with open(os.path.join(cache_dir, "urls", hashlib.sha256(url.encode("utf-8")).hexdigest()), "w") as f:
+        f.write(sha256)
+    return sha256
+
+
+@pytest.mark.parametrize("url", [ZIP_URL, TAR_URL])
+def test_extract_from_cached_archive(setup_module, tmp_path, url):
+    seed_cache(setup_module, url, make_archive(url))
+    dest = tmp_path / "bin"
+
+    setup_module.download_credential_provider(str(dest), url)
+
+    plugin_dir = dest / PLUGIN_DIR
+    assert (plugin_dir / "CredentialProvider.Microsoft.dll").read_bytes() == b"assembly"
+    assert not (plugin_dir / "libcoreclrtraceptprovider.so").exists()
+    if not sys.platform.startswith("win"):
+        assert os.stat(plugin_dir / "CredentialProvider.Microsoft").st_mode & 0o777 == 0o755
+
+
+def test_matching_extraction_is_skipped(setup_module, tmp_path, monkeypatch):
+    seed_cache(setup_module, ZIP_URL, make_archive(ZIP_URL))
+    dest = tmp_path / "bin"
+    setup_module.download_credential_provider(str(dest), ZIP_URL)
+
+    extracted = []
+    monkeypatch.setattr(setup_module, "extract_archive", lambda *args: extracted.append(args))
+    setup_module.download_credential_provider(str(dest), ZIP_URL)
+    assert extracted == []
+
+    # A modified tree no longer matches its manifest and is extracted again
+    (dest / PLUGIN_DIR / "CredentialProvider.Microsoft.dll").write_bytes(b"changed")
+    setup_module.download_credential_provider(str(dest), ZIP_URL)
+    assert len(extracted) == 1
+
+
+def test_cached_archive_by_digest(setup_module, tmp_path, monkeypatch):
+    sha256 = seed_cache(setup_module, TAR_URL, make_archive(TAR_URL))
+    monkeypatch.setenv(setup_module.CREDENTIAL_PROVIDER_SHA256_VAR_NAME, sha256.upper())
+    setup_module.download_credential_provider(str(tmp_path / "bin"), TAR_URL)
+    assert (tmp_path / "bin" / PLUGIN_DIR / "CredentialProvider.Microsoft.dll").exists()
+
+    # The digest must have been recorded for the URL, not just be in the cache
+    with pytest.raises(AssertionError, match="downloaded " + ZIP_URL):
+        setup_module.fetch_archive(ZIP_URL, sha256)
+    seed_cache(setup_module, ZIP_URL, make_archive(ZIP_URL))
+    with pytest.raises(AssertionError, match="downloaded " + ZIP_URL):
+        setup_module.fetch_archive(ZIP_URL, sha256)
+
+
+def test_corrupt_cached_archive_is_not_used(setup_module, tmp_path):
+    sha256 = seed_cache(setup_module, ZIP_URL, make_archive(ZIP_URL))
+    archive = os.path.join(setup_module.get_archive_cache_dir(), "archives", sha256)
+    with open(archive, "ab") as f:
+        f.write(b"tampered")
+
+    with pytest.raises(AssertionError, match="downloaded " + ZIP_URL):
+        setup_module.download_credential_provider(str(tmp_path / "bin"), ZIP_URL)
+    assert not os.path.exists(archive)
+
+
+def test_download_is_verified_and_cached(setup_module, tmp_path, monkeypatch):
+    data = make_archive(ZIP_URL)
+    monkeypatch.setattr(setup_module.urllib.request, "urlopen", lambda url: io.BytesIO(data))
+
+    with pytest.raises(RuntimeError, match="expected 0000"):
+        setup_module.fetch_archive(ZIP_URL, "0" * 64)
+    assert os.listdir(os.path.join(setup_module.get_archive_cache_dir(), "archives")) == []
+
+    path = setup_module.fetch_archive(ZIP_URL)
+    assert os.path.basename(path) == hashlib.sha256(data).hexdigest()
+    assert setup_module.get_cached_archive(setup_module.get_archive_cache_dir(), ZIP_URL) == path